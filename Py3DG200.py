@@ -8,6 +8,30 @@
 #
 # Version: 1.4
 # changelog: 
+#   -1.6 :
+#       - protocol layer works on bytes instead of lists of hex strings
+#       - vectorized track decoding when numpy is available
+#       - GPX files are written while downloading
+#       - tracks are downloaded in a separate thread, with a cancel button
+#       - downloaded track parts are cached, sync only downloads new ones
+#       - command line interface, GTK is only needed by the GUI
+#       - download from all the detected devices at once
+#       - faster detection: all the ports are probed at once
+#       - track parts are downloaded while the previous ones are decoded
+#       - asyncio client, AsyncDG200
+#       - resynchronisation on corrupted answers, bounded retries
+#       - columnar Track structure shared by decoding, cache and export
+#       - header table indexed by session, track list read page by page
+#       - raw memory dumps, decoded later from a memory mapping
+#       - CSV, GeoJSON and binary columnar (.track, .npz) exporters
+#       - metrics of the exchanges and download stages, JSON log
+#       - parallel export of the sessions by a process pool, merged GPX
+#       - track simplification and resampling before the export
+#       - configuration codec, device state kept between commands
+#       - resumable downloads, track parts saved as they are received
+#       - buffered frame parser, frames received together read at once
+#       - watch command, synchronising the devices as they are plugged in
+#       - spatial and temporal index of the written tracks, find command
 #   -1.5 :
 #       - bug correction for below 0 elevations
 #   -1.4 :
@@ -25,20 +49,65 @@
 # Needs:
 #   python 3
 #   python3-pyserial
-#   gtk+ 
+#   python3-numpy (optional, faster track decoding)
+#   gtk+ (only for the graphical interface)
 # Licence: GPL3 http://gplv3.fsf.org/
 #
 
+import abc
+import argparse
+import array
+import asyncio
+import calendar
+import concurrent.futures
+import glob
+import math
+import io
+import itertools
+import json
+import mmap
+import multiprocessing
 import os
+import queue
+import select
+import shutil
+import struct
+import sys
+import threading
 import time
-from serial import Serial
-
-import gi
-gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
+from serial import Serial, SerialException
+from serial.tools import list_ports
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 isDebug = False
 
+# GTK is only imported when the graphical interface is used
+GLib = None
+Gtk = None
+
+def import_gtk():
+    '''Imports GTK, only needed by the graphical interface'''
+    global GLib, Gtk
+    import gi
+    gi.require_version('Gtk', '3.0')
+    from gi.repository import GLib, Gtk
+
+def hexlist2bytes(hexlist):
+    '''Compatibility shim: converts the old ['0xNN', ...] form to bytes.
+    Bytes-like objects are returned untouched'''
+    if isinstance(hexlist, (bytes, bytearray, memoryview)):
+        return hexlist
+    if isinstance(hexlist, str):
+        hexlist = [hexlist]
+    return bytes(int(x, 16) for x in hexlist)
+
+def bytes2hexlist(data):
+    '''Compatibility shim: converts bytes to the old ['0xNN', ...] form'''
+    return ['0x%02X' % x for x in data]
+
 def int2bytes(number,nbBytes):
     if number>= 0:
         hexformat = '{0:0>' + str(nbBytes * 2) + 'X}'
@@ -46,96 +115,2638 @@ def int2bytes(number,nbBytes):
     else:
         return None
 
-def bytes2int(bytes):
-    return int(''.join(bytes).replace('0x',''),16)
+def bytes2int(raw):
+    if isinstance(raw, int):
+        return raw
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        return int.from_bytes(raw, 'big')
+    # old list of '0xNN' strings
+    if isinstance(raw, str):
+        raw = [raw]
+    return int(''.join(raw).replace('0x',''),16)
+
+def degrees(value):
+    '''Converts the DDDMMmmmm integer coding of the device to degrees'''
+    if value >> 24 > 128: # then it's negative
+        value = 2**32 - value
+        return - float(value // 1000000) - float(value % 1000000)/600000
+    return float(value // 1000000) + float(value % 1000000)/600000
 
 def process_point(raw_point):
+    raw_point = hexlist2bytes(raw_point)
     if isDebug:
-        print(raw_point)
+        print(bytes(raw_point).hex(' '))
 
-    if bytes2int(raw_point[0]) > 128: # then it's negative
-        mega_latitude = '{0:0>9d}'.format(2**32 - bytes2int(raw_point[:4]))
-        latitude = - float(str(mega_latitude)[:-6]) \
-            - float(str(mega_latitude)[-6:])/600000
-    else:
-        mega_latitude = '{0:0>9d}'.format(bytes2int(raw_point[:4]))
-        latitude = float(str(mega_latitude)[:-6]) \
-            + float(str(mega_latitude)[-6:])/600000
-    if bytes2int(raw_point[4]) > 128: # then it's negative
-        mega_longitude = '{0:0>9d}'.format(2**32 - bytes2int(raw_point[4:8]))
-        longitude = - float(str(mega_longitude)[:-6]) \
-            - float(str(mega_longitude)[-6:])/600000
-    else:
-        mega_longitude = '{0:0>9d}'.format(bytes2int(raw_point[4:8]))
-        longitude = float(str(mega_longitude)[:-6]) \
-            + float(str(mega_longitude)[-6:])/600000
-    utime = \
-    '{0:0>6d}'.format(bytes2int(raw_point[9:12]))
-    udate = \
-    '{0:0>6d}'.format(bytes2int(raw_point[12:16]))
-    timestamp = '20' + udate[4:6] + '-' + udate[2:4] + \
-            '-' + udate[:2] + 'T' + utime[:2] + ':' + \
-            utime[2:4] + ':' + utime[4:6] + 'Z'
-    speed = bytes2int(raw_point[16:20]) / 100 / 3.6  # speed in m/s
+    latitude, longitude, utime, udate, speed = \
+            struct.unpack_from('>IIIII', raw_point)
+    latitude = degrees(latitude)
+    longitude = degrees(longitude)
+    utime = utime & 0xFFFFFF # first byte is not part of the time
+    timestamp = '20{0:02d}-{1:02d}-{2:02d}T{3:02d}:{4:02d}:{5:02d}Z'.format(
+            udate % 100, udate // 100 % 100, udate // 10000,
+            utime // 10000, utime // 100 % 100, utime % 100)
+    speed = speed / 100 / 3.6  # speed in m/s
     if len(raw_point) == 20:
         return [latitude, longitude, timestamp, speed]
     elif len(raw_point) == 32:
-        if bytes2int(raw_point[20]) > 128: # then it's negative
-            altitude = - (2**32 - bytes2int(raw_point[20:24])) / 10000
+        altitude = struct.unpack_from('>I', raw_point, 20)[0]
+        if altitude >> 24 > 128: # then it's negative
+            altitude = - (2**32 - altitude) / 10000
         else:
-            altitude = bytes2int(raw_point[20:24]) / 10000
+            altitude = altitude / 10000
         return [latitude, longitude, timestamp, speed, altitude]
     else:
         return None
 
-def write_gpx(folder, track):
-    filename = folder + '/' + track[0][2] + '.gpx'
-    gpx_file = open(filename, 'w')
-    gpx_file.write('<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n')
-    gpx_file.write('<gpx xmlns="http://www.topografix.com/GPX/1/1"\
+if numpy is not None:
+    # Records as stored by the device, all fields are big-endian
+    RECORD_DTYPES = {
+        20: numpy.dtype([('lat', '>u4'), ('lon', '>u4'), ('time', '>u4'),
+                         ('date', '>u4'), ('speed', '>u4')]),
+        32: numpy.dtype([('lat', '>u4'), ('lon', '>u4'), ('time', '>u4'),
+                         ('date', '>u4'), ('speed', '>u4'), ('alt', '>u4'),
+                         ('unused', 'V8')]),
+        }
+
+def array_degrees(value):
+    '''Vectorized version of degrees()'''
+    value = value.astype(numpy.int64)
+    negative = (value >> 24) > 128
+    value = numpy.where(negative, 2**32 - value, value)
+    whole = (value // 1000000).astype(numpy.float64)
+    minutes = (value % 1000000).astype(numpy.float64)/600000
+    return numpy.where(negative, - whole - minutes, whole + minutes)
+
+def decode_records(records):
+    '''Decodes an array of RECORD_DTYPES records into a dictionary of
+    columns: latitude, longitude, time and date (as hhmmss and ddmmyy
+    integers), speed (m/s) and altitude (nan for 20 bytes records)'''
+    columns = {
+        'latitude': array_degrees(records['lat']),
+        'longitude': array_degrees(records['lon']),
+        'time': (records['time'] & 0xFFFFFF).astype(numpy.int64),
+        'date': records['date'].astype(numpy.int64),
+        'speed': records['speed'].astype(numpy.float64) / 100 / 3.6,
+        }
+    if 'alt' in records.dtype.names:
+        altitude = records['alt'].astype(numpy.int64)
+        negative = (altitude >> 24) > 128
+        columns['altitude'] = numpy.where(negative,
+                -(2**32 - altitude).astype(numpy.float64) / 10000,
+                altitude.astype(numpy.float64) / 10000)
+    else:
+        columns['altitude'] = numpy.full(len(records), numpy.nan)
+    return columns
+
+def decode_track_part(track_raw):
+    '''Vectorized decoding of a track part (both halves of the 0xB5 answer,
+    without their command bytes) with numpy. Returns the columns of
+    decode_records()'''
+    raw = numpy.frombuffer(track_raw, dtype=numpy.uint8)
+    end = len(raw)
+    point_format = bytes2int(track_raw[28:32])
+    if point_format == 1:
+        size = 20
+        end -= 16 # remove the 16 trailing FFs
+    elif point_format == 2:
+        size = 32
+    else:
+        return decode_records(numpy.zeros(0, RECORD_DTYPES[32]))
+    # remove the trailing records only made of 0xFF
+    chunks = raw[end % size:end].reshape(-1, size)
+    padding = (chunks == 0xFF).all(axis=1)
+    used = numpy.flatnonzero(~padding)
+    end -= size * (len(chunks) - (used[-1] + 1 if len(used) else 0))
+
+    if point_format == 1:
+        # first point is in 32 bytes format
+        first = decode_records(numpy.frombuffer(track_raw, RECORD_DTYPES[32],
+                count=1))
+        nb_points = max(end - 32, 0) // 20
+        others = decode_records(numpy.frombuffer(track_raw, RECORD_DTYPES[20],
+                count=nb_points, offset=32))
+        return dict((key, numpy.concatenate((first[key], others[key])))
+                for key in first)
+    return decode_records(numpy.frombuffer(track_raw, RECORD_DTYPES[32],
+            count=end // 32))
+
+def columns_timestamps(columns):
+    '''ISO 8601 strings of the date and time columns of decode_records(),
+    formatted in one numpy call'''
+    udate = columns['date']
+    utime = columns['time']
+    day = udate // 10000
+    month = udate // 100 % 100
+    months = ((udate % 100 + 30) * 12 + month - 1).astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + (day - 1)
+    hours = utime // 10000
+    minutes = utime // 100 % 100
+    valid = (month >= 1) & (month <= 12) & (day >= 1) & \
+            (days.astype('datetime64[M]') == months) & (hours < 24) & \
+            (minutes < 60) & (utime % 100 < 60)
+    if not valid.all():
+        # not a date: the fields are written as they are
+        return ['20{0:02d}-{1:02d}-{2:02d}T{3:02d}:{4:02d}:{5:02d}Z'.format(
+                udate % 100, udate // 100 % 100, udate // 10000,
+                utime // 10000, utime // 100 % 100, utime % 100)
+                for udate, utime in zip(udate.tolist(), utime.tolist())]
+    seconds = days.astype('datetime64[s]') + \
+            (hours * 3600 + minutes * 60 + utime % 100)
+    return numpy.datetime_as_string(seconds, timezone='UTC').tolist()
+
+def columns2points(columns):
+    '''Converts columns from decode_records() to the list of points
+    returned by process_point()'''
+    with_altitude = ~numpy.isnan(columns['altitude'])
+    coordinates = (columns['latitude'].tolist(),
+            columns['longitude'].tolist(), columns_timestamps(columns),
+            columns['speed'].tolist())
+    if with_altitude.all():
+        return list(map(list, zip(*coordinates,
+                columns['altitude'].tolist())))
+    track = list(map(list, zip(*coordinates)))
+    # the first point of 20 bytes records parts has an altitude
+    for position in numpy.flatnonzero(with_altitude).tolist():
+        track[position].append(float(columns['altitude'][position]))
+    return track
+
+def process_track_part(track_raw):
+    '''Decodes the payload of a track part (both halves of the 0xB5 answer,
+    without their command bytes) into a list of points'''
+    if numpy is not None:
+        return columns2points(decode_track_part(track_raw))
+
+    track = []
+    end = len(track_raw)
+    # processing of the raw data (remove trailing 0xFF)
+    if bytes2int(track_raw[28:32]) == 1:
+        # Then it's a 20bytes coding (pos,date/time,speed)
+        end -= 16 # remove the 16 trailing FFs
+        while end >= 20 and track_raw[end-20:end] == b'\xFF' * 20:
+            end -= 20
+
+        # first point (which is in 32 bytes format)
+        track.append(process_point(track_raw[:32]))
+        nb_points = int((end - 32) / 20 + 1)
+        # next points
+        for point in range(1,nb_points):
+            track.append(process_point(track_raw[32+20*(point-1):32+20*point]))
+
+    elif bytes2int(track_raw[28:32]) == 2:
+        ## Then it's a 32bytes coding (pos,date/time,speed,altitude)
+        while end >= 32 and track_raw[end-32:end] == b'\xFF' * 32:
+            end -= 32
+
+        nb_points = int(end/32)
+        for point in range(0,nb_points):
+            track.append(process_point(track_raw[32*point:32+32*point]))
+    return track
+
+def epoch_seconds(udate, utime):
+    '''Converts ddmmyy dates and hhmmss times (ints or numpy arrays) to
+    seconds since 1970, years being counted from 2000'''
+    day = udate // 10000
+    month = udate // 100 % 100
+    year = 2000 + udate % 100
+    # days from civil, with years starting in March
+    month = (month + 9) % 12
+    year = year - (month >= 10)
+    era = year // 400
+    year_of_era = year - era * 400
+    days = era * 146097 + year_of_era * 365 + year_of_era // 4 \
+            - year_of_era // 100 + (153 * month + 2) // 5 + day - 1 - 719468
+    return days * 86400 + utime // 10000 * 3600 + utime // 100 % 100 * 60 \
+            + utime % 100
+
+def format_timestamp(seconds):
+    '''ISO 8601 string of a time in seconds since 1970'''
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+class TrackPoint:
+    '''View on one point of a Track'''
+    __slots__ = ('track', 'position')
+
+    def __init__(self, track, position):
+        self.track = track
+        self.position = position
+
+    @property
+    def latitude(self):
+        return self.track.latitude[self.position]
+
+    @property
+    def longitude(self):
+        return self.track.longitude[self.position]
+
+    @property
+    def time(self):
+        '''seconds since 1970'''
+        return self.track.time[self.position]
+
+    @property
+    def timestamp(self):
+        return format_timestamp(self.time)
+
+    @property
+    def speed(self):
+        '''m/s'''
+        return self.track.speed[self.position]
+
+    @property
+    def altitude(self):
+        '''m, None if the point has no altitude'''
+        altitude = self.track.altitude[self.position]
+        if altitude != altitude: # nan
+            return None
+        return altitude
+
+    @property
+    def waypoint(self):
+        return self.track.is_waypoint(self.position)
+
+    def as_list(self):
+        '''The point as returned by process_point'''
+        return self.track.point_list(self.position, self.timestamp)
+
+class Track:
+    '''Decoded track, stored by columns: latitude, longitude (degrees), time
+    (seconds since 1970), speed (m/s) and altitude (m, nan for points
+    without altitude) arrays, and a bitmask of the waypoints. Timestamps
+    are only formatted for exports'''
+    def __init__(self):
+        self.latitude = array.array('d')
+        self.longitude = array.array('d')
+        self.time = array.array('q')
+        self.speed = array.array('d')
+        self.altitude = array.array('d')
+        self.waypoints = bytearray()
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('track point index out of range')
+        return TrackPoint(self, position)
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield TrackPoint(self, position)
+
+    def is_waypoint(self, position):
+        return bool(self.waypoints[position >> 3] & (1 << (position & 7)))
+
+    def set_waypoints(self, positions):
+        '''Marks positions as waypoints, growing the bitmask to the length
+        of the track'''
+        self.waypoints.extend(bytes((len(self) + 7) // 8 - len(self.waypoints)))
+        for position in positions:
+            self.waypoints[position >> 3] |= 1 << (position & 7)
+
+    def append(self, latitude, longitude, seconds, speed, altitude=None,
+            waypoint=False):
+        self.latitude.append(latitude)
+        self.longitude.append(longitude)
+        self.time.append(seconds)
+        self.speed.append(speed)
+        self.altitude.append(float('nan') if altitude is None else altitude)
+        self.set_waypoints([len(self) - 1] if waypoint else [])
+
+    def extend(self, track):
+        '''Appends the points of another track'''
+        start = len(self)
+        for column in ('latitude', 'longitude', 'time', 'speed', 'altitude'):
+            getattr(self, column).extend(getattr(track, column))
+        self.set_waypoints(start + position for position in range(len(track))
+                if track.is_waypoint(position))
+
+    @classmethod
+    def from_points(cls, points):
+        '''Builds a track from points as returned by process_point, where
+        waypoints have 100 added to their latitude'''
+        track = cls()
+        for point in points:
+            latitude = point[0]
+            waypoint = abs(latitude) > 100
+            if waypoint:
+                latitude = latitude - 100 if latitude > 0 else latitude + 100
+            timestamp = point[2]
+            seconds = epoch_seconds(
+                    int(timestamp[8:10] + timestamp[5:7] + timestamp[2:4]),
+                    int(timestamp[11:13] + timestamp[14:16] + timestamp[17:19]))
+            track.append(latitude, point[1], seconds, point[3],
+                    point[4] if len(point) == 5 else None, waypoint)
+        return track
+
+    @classmethod
+    def from_columns(cls, columns):
+        '''Builds a track from the numpy columns of decode_records'''
+        track = cls()
+        latitude = columns['latitude']
+        waypoints = numpy.abs(latitude) > 100
+        latitude = numpy.where(latitude > 100, latitude - 100,
+                numpy.where(latitude < -100, latitude + 100, latitude))
+        track.latitude.frombytes(latitude.astype(numpy.float64).tobytes())
+        track.longitude.frombytes(
+                columns['longitude'].astype(numpy.float64).tobytes())
+        track.time.frombytes(epoch_seconds(columns['date'],
+                columns['time']).astype(numpy.int64).tobytes())
+        track.speed.frombytes(columns['speed'].astype(numpy.float64).tobytes())
+        track.altitude.frombytes(
+                columns['altitude'].astype(numpy.float64).tobytes())
+        track.waypoints = bytearray(numpy.packbits(waypoints,
+                bitorder='little').tobytes())
+        return track
+
+    def take(self, positions):
+        '''New track with the points at positions (in increasing order)'''
+        track = Track()
+        if numpy is not None:
+            positions = numpy.asarray(positions, numpy.intp)
+            for column, dtype in (('latitude', numpy.float64),
+                    ('longitude', numpy.float64), ('time', numpy.int64),
+                    ('speed', numpy.float64), ('altitude', numpy.float64)):
+                getattr(track, column).frombytes(numpy.frombuffer(
+                        getattr(self, column), dtype)[positions].tobytes())
+        else:
+            for column in ('latitude', 'longitude', 'time', 'speed',
+                    'altitude'):
+                values = getattr(self, column)
+                getattr(track, column).extend(values[position]
+                        for position in positions)
+        track.set_waypoints(new for new, position in enumerate(positions)
+                if self.is_waypoint(position))
+        return track
+
+    def slice(self, start, stop):
+        '''New track with the points start to stop'''
+        stop = min(stop, len(self))
+        track = Track()
+        for column in ('latitude', 'longitude', 'time', 'speed', 'altitude'):
+            getattr(track, column).extend(getattr(self, column)[start:stop])
+        track.set_waypoints(position - start for position in range(start, stop)
+                if self.is_waypoint(position))
+        return track
+
+    def timestamps(self, start=0, stop=None):
+        '''ISO 8601 strings of the times of the points start to stop'''
+        if stop is None:
+            stop = len(self)
+        if numpy is not None:
+            seconds = numpy.frombuffer(self.time, numpy.int64)[start:stop]
+            return [timestamp + 'Z' for timestamp in numpy.datetime_as_string(
+                    seconds.astype('datetime64[s]')).tolist()]
+        return [format_timestamp(seconds) for seconds in self.time[start:stop]]
+
+    def point_list(self, position, timestamp):
+        latitude = self.latitude[position]
+        if self.is_waypoint(position):
+            latitude = latitude + 100 if latitude >= 0 else latitude - 100
+        point = [latitude, self.longitude[position], timestamp,
+                self.speed[position]]
+        altitude = self.altitude[position]
+        if altitude == altitude: # not nan
+            point.append(altitude)
+        return point
+
+    def points(self):
+        '''Iterates over the points as returned by process_point'''
+        for start in range(0, len(self), 1000):
+            for position, timestamp in enumerate(
+                    self.timestamps(start, start + 1000), start):
+                yield self.point_list(position, timestamp)
+
+    def to_bytes(self):
+        '''Serializes the track, in the native byte order'''
+        return b''.join([struct.pack('=4sQ', b'TRK1', len(self)),
+                self.latitude.tobytes(), self.longitude.tobytes(),
+                self.time.tobytes(), self.speed.tobytes(),
+                self.altitude.tobytes(), bytes(self.waypoints)])
+
+    @classmethod
+    def from_bytes(cls, data):
+        '''Reads a track serialized by to_bytes'''
+        magic, length = struct.unpack_from('=4sQ', data)
+        if magic != b'TRK1':
+            raise ValueError('not a serialized track')
+        track = cls()
+        position = struct.calcsize('=4sQ')
+        for column in ('latitude', 'longitude', 'time', 'speed', 'altitude'):
+            values = getattr(track, column)
+            values.frombytes(data[position:position + 8 * length])
+            position += 8 * length
+        track.waypoints = bytearray(data[position:position + (length + 7) // 8])
+        if len(track.time) != length or \
+                len(track.waypoints) != (length + 7) // 8:
+            raise ValueError('truncated track')
+        return track
+
+def decode_track(track_raw):
+    '''Decodes the payload of a track part (see process_track_part) into a
+    Track'''
+    if numpy is not None:
+        return Track.from_columns(decode_track_part(track_raw))
+    return Track.from_points(process_track_part(track_raw))
+
+GPX_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n\
+<gpx xmlns="http://www.topografix.com/GPX/1/1"\
  creator="Py3DG200" version="1.6"\
  xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"\
  xsi:schemaLocation="http://www.topografix.com/GPX/1/1\
- http://www.topografix.com/GPX/1/1/gpx.xsd">\n')
-
-    for point in track:
-        # first iteration to find waypoints
-        if abs(point[0]) > 100:
-            gpx_file.write('    <wpt lat="' + format((point[0]-100), '.7f') +\
-                    '" lon="' + format(point[1], '.7f') + '">\n')
-            gpx_file.write('      <time>' + point[2] + '</time>\n')
-            gpx_file.write('      <speed>' + str(point[3]) + '</speed>\n')
-            if len(point) == 5:
-                gpx_file.write('      <ele>' + str(point[4]) + '</ele>\n')
-            gpx_file.write('    </wpt>\n')
-
-    gpx_file.write('  <trk>\n')
-    gpx_file.write('    <name>DG-200 ' + track[0][2] + '</name>\n')
-    gpx_file.write('    <trkseg>\n')
-    for point in track:
-        # Now for track points
-        if abs(point[0]) < 100:
-            gpx_file.write('      <trkpt lat="' + format(point[0], '.7f') + '" lon="' + \
-                    format(point[1], '.7f') + '">\n')
-            gpx_file.write('        <time>' + str(point[2]) + '</time>\n')
-            gpx_file.write('        <speed>' + str(point[3]) + '</speed>\n')
-            if len(point) == 5:
-                gpx_file.write('        <ele>' + str(point[4]) + '</ele>\n')
-            gpx_file.write('      </trkpt>\n')
-
-    gpx_file.write('    </trkseg>\n')
-    gpx_file.write('  </trk>\n')
-    gpx_file.write('</gpx>\n')
-    gpx_file.close()
-
-
-class DG200(Serial):
+ http://www.topografix.com/GPX/1/1/gpx.xsd">\n'
+GPX_TRACK_HEADER = '  <trk>\n    <name>DG-200 {0}</name>\n    <trkseg>\n'
+GPX_TRACK_FOOTER = '    </trkseg>\n  </trk>\n'
+GPX_FOOTER = GPX_TRACK_FOOTER + '</gpx>\n'
+
+class TrackWriter(abc.ABC):
+    '''Base of the exporters: a track is written to a file in folder, named
+    after the time of its first point, as Tracks or points (as returned by
+    process_point) are given. Subclasses set extension and write the
+    points in blocks of block_size in write_block'''
+    extension = None
+    mode = 'w'
+    block_size = 1000 # number of points per write() call
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.filename = None
+        self.out_file = None
+
+    def write(self, points):
+        '''Adds a Track or an iterable of points (as returned by
+        process_point)'''
+        if not isinstance(points, Track):
+            points = Track.from_points(points)
+        for start in range(0, len(points), self.block_size):
+            stop = min(start + self.block_size, len(points))
+            timestamps = points.timestamps(start, stop)
+            if self.out_file is None:
+                self.open(timestamps[0])
+            self.write_block(points, start, stop, timestamps)
+
+    @abc.abstractmethod
+    def write_block(self, track, start, stop, timestamps):
+        '''Writes the points start to stop of track, timestamps being their
+        times as text'''
+
+    def open(self, timestamp):
+        self.filename = self.folder + '/' + timestamp + self.extension
+        # the file only gets its name once complete, see close
+        self.out_file = open(self.filename + '.part', self.mode,
+                buffering=2**20)
+        self.write_header(timestamp)
+
+    def write_header(self, timestamp):
+        pass
+
+    def write_footer(self):
+        pass
+
+    def close(self):
+        '''Finishes the file, returns its name (None if no point was
+        written)'''
+        if self.out_file is None:
+            return None
+        self.write_footer()
+        self.out_file.close()
+        self.out_file = None
+        self.finalize(self.filename + '.part')
+        return self.filename
+
+    def finalize(self, partial):
+        '''Gives its name to partial, the complete file'''
+        os.replace(partial, self.filename)
+
+    def abort(self):
+        '''Removes the file of a track which won't be completed'''
+        if self.out_file is not None:
+            self.out_file.close()
+            self.out_file = None
+            os.remove(self.filename + '.part')
+
+class GpxWriter(TrackWriter):
+    '''Streaming GPX writer: points are written as they are given, in large
+    blocks, so that the whole track never has to be kept in memory.
+    Waypoints are kept aside and put before the track when closing, as
+    required by the GPX schema'''
+    extension = '.gpx'
+
+    def __init__(self, folder):
+        TrackWriter.__init__(self, folder)
+        self.waypoints = []
+        self.block = []
+        self.track_offset = 0
+
+    def write(self, points):
+        '''Adds a Track or an iterable of points (as returned by
+        process_point)'''
+        if isinstance(points, Track):
+            TrackWriter.write(self, points)
+            return
+        for point in points:
+            if self.out_file is None:
+                self.open(point[2])
+            if abs(point[0]) > 100:
+                # waypoint
+                latitude = point[0] - 100 if point[0] > 0 else point[0] + 100
+                self.waypoints.append(self.format_point(
+                        '    <wpt', latitude, point, '    </wpt>\n'))
+            elif abs(point[0]) < 100:
+                self.block.append(self.format_point(
+                        '      <trkpt', point[0], point, '      </trkpt>\n'))
+                if len(self.block) >= self.block_size:
+                    self.flush()
+
+    def write_block(self, track, start, stop, timestamps):
+        for position, point in enumerate(zip(
+                track.latitude[start:stop], track.longitude[start:stop],
+                timestamps, track.speed[start:stop],
+                track.altitude[start:stop]), start):
+            if point[4] != point[4]: # nan: no altitude
+                point = point[:4]
+            if track.is_waypoint(position):
+                self.waypoints.append(self.format_point(
+                        '    <wpt', point[0], point, '    </wpt>\n'))
+            else:
+                self.block.append(self.format_point(
+                        '      <trkpt', point[0], point, '      </trkpt>\n'))
+        self.flush()
+
+    def format_point(self, tag, latitude, point, end):
+        indent = tag[:tag.index('<')] + '  '
+        text = tag + ' lat="' + format(latitude, '.7f') + '" lon="' + \
+                format(point[1], '.7f') + '">\n' + \
+                indent + '<time>' + point[2] + '</time>\n' + \
+                indent + '<speed>' + str(point[3]) + '</speed>\n'
+        if len(point) == 5:
+            text += indent + '<ele>' + str(point[4]) + '</ele>\n'
+        return text + end
+
+    def write_header(self, timestamp):
+        self.out_file.write(GPX_HEADER)
+        self.track_offset = self.out_file.tell()
+        self.out_file.write(GPX_TRACK_HEADER.format(timestamp))
+
+    def flush(self):
+        self.out_file.write(''.join(self.block))
+        self.block = []
+
+    def write_footer(self):
+        self.flush()
+        self.out_file.write(GPX_FOOTER)
+
+    def finalize(self, partial):
+        if not self.waypoints:
+            os.replace(partial, self.filename)
+            return
+        # Waypoints go before the track: the track is appended to them
+        # without going through Python
+        with open(partial, 'rb') as gpx_file, \
+                open(self.filename + '.tmp', 'wb') as tmp_file:
+            tmp_file.write((GPX_HEADER + ''.join(self.waypoints)).encode())
+            tmp_file.flush()
+            append_file(gpx_file, self.track_offset, tmp_file)
+        os.replace(self.filename + '.tmp', self.filename)
+        os.remove(partial)
+        self.waypoints = []
+
+    def abort(self):
+        TrackWriter.abort(self)
+        self.waypoints = []
+        self.block = []
+
+def append_file(source, offset, target):
+    '''Appends the binary file source from offset to the binary file
+    target, copied by the kernel where possible'''
+    size = os.fstat(source.fileno()).st_size - offset
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while size > 0:
+                copied = os.copy_file_range(source.fileno(), target.fileno(),
+                        size, offset)
+                if not copied:
+                    break
+                offset += copied
+                size -= copied
+            return
+        except OSError:
+            # not supported by the file system
+            pass
+    source.seek(offset)
+    shutil.copyfileobj(source, target, 2**20)
+
+class GpxFragmentWriter(GpxWriter):
+    '''GpxWriter keeping the <trk> element and the waypoints of a track in
+    memory, to be merged with other tracks in one GPX file (see
+    write_merged_gpx)'''
+    def open(self, timestamp):
+        self.timestamp = timestamp
+        self.out_file = io.StringIO()
+        self.out_file.write(GPX_TRACK_HEADER.format(timestamp))
+
+    def close(self):
+        '''Returns the time of the first point, the <trk> element and the
+        waypoints (None if no point was written)'''
+        if self.out_file is None:
+            return None
+        self.flush()
+        self.out_file.write(GPX_TRACK_FOOTER)
+        fragment = (self.timestamp, self.out_file.getvalue(),
+                ''.join(self.waypoints))
+        self.out_file = None
+        self.waypoints = []
+        return fragment
+
+    def abort(self):
+        self.out_file = None
+        self.waypoints = []
+
+def write_merged_gpx(folder, fragments):
+    '''Writes the fragments of GpxFragmentWriter in one GPX file in folder,
+    with one <trk> element per fragment, named after the first one.
+    Returns the file name, None if there is no fragment'''
+    fragments = [fragment for fragment in fragments if fragment is not None]
+    if not fragments:
+        return None
+    filename = folder + '/' + fragments[0][0] + '.gpx'
+    with open(filename + '.tmp', 'w', buffering=2**20) as gpx_file:
+        gpx_file.write(GPX_HEADER)
+        # all the waypoints go before the tracks
+        for fragment in fragments:
+            gpx_file.write(fragment[2])
+        for fragment in fragments:
+            gpx_file.write(fragment[1])
+        gpx_file.write('</gpx>\n')
+    os.replace(filename + '.tmp', filename)
+    # summaries of IndexingWriter
+    write_index_entries(filename, [fragment[3] if len(fragment) > 3 else None
+            for fragment in fragments])
+    return filename
+
+class CsvWriter(TrackWriter):
+    '''Streaming CSV writer, one line per point: time, latitude, longitude,
+    speed (m/s), altitude (m, empty if unknown) and waypoint (0 or 1)'''
+    extension = '.csv'
+
+    def write_header(self, timestamp):
+        self.out_file.write('time,latitude,longitude,speed,altitude,'
+                'waypoint\n')
+
+    def write_block(self, track, start, stop, timestamps):
+        self.out_file.write(''.join(
+                timestamp + ',' + format(latitude, '.7f') + ',' +
+                format(longitude, '.7f') + ',' + str(speed) + ',' +
+                (str(altitude) if altitude == altitude else '') +
+                (',1\n' if track.is_waypoint(position) else ',0\n')
+                for position, timestamp, latitude, longitude, speed, altitude
+                in zip(range(start, stop), timestamps,
+                    track.latitude[start:stop], track.longitude[start:stop],
+                    track.speed[start:stop], track.altitude[start:stop])))
+
+class GeoJsonWriter(TrackWriter):
+    '''Streaming GeoJSON writer: a FeatureCollection with the track as a
+    LineString, whose point times and speeds are in its coordTimes and
+    speeds properties, and a Point feature for each waypoint. Only the
+    coordinates are written as they are given: the times and speeds (16
+    bytes per point) and the waypoints come after them in the file, they
+    are kept in memory until the end of the track'''
+    extension = '.geojson'
+
+    def __init__(self, folder):
+        TrackWriter.__init__(self, folder)
+        self.waypoints = []
+        self.times = array.array('q')
+        self.speeds = array.array('d')
+        self.name = None
+
+    @staticmethod
+    def coordinates(latitude, longitude, altitude):
+        if altitude != altitude: # nan
+            return '[' + format(longitude, '.7f') + ', ' + \
+                    format(latitude, '.7f') + ']'
+        return '[' + format(longitude, '.7f') + ', ' + \
+                format(latitude, '.7f') + ', ' + str(altitude) + ']'
+
+    def write_header(self, timestamp):
+        self.name = 'DG-200 ' + timestamp
+        self.out_file.write('{"type": "FeatureCollection", "features": [\n'
+                '{"type": "Feature", "geometry": {"type": "LineString", '
+                '"coordinates": [')
+
+    def write_block(self, track, start, stop, timestamps):
+        coordinates = []
+        for position, latitude, longitude, altitude, point_time, speed in zip(
+                range(start, stop), track.latitude[start:stop],
+                track.longitude[start:stop], track.altitude[start:stop],
+                track.time[start:stop], track.speed[start:stop]):
+            if track.is_waypoint(position):
+                self.waypoints.append(',\n{"type": "Feature", "geometry": '
+                        '{"type": "Point", "coordinates": ' +
+                        self.coordinates(latitude, longitude, altitude) +
+                        '}, "properties": {"time": "' +
+                        timestamps[position - start] + '", "speed": ' +
+                        str(speed) + '}}')
+            else:
+                coordinates.append(self.coordinates(latitude, longitude,
+                        altitude))
+                self.times.append(point_time)
+                self.speeds.append(speed)
+        if coordinates:
+            if len(self.times) > len(coordinates):
+                self.out_file.write(',')
+            self.out_file.write('\n' + ',\n'.join(coordinates))
+
+    def write_footer(self):
+        # the times are only kept as integers until the end of the track
+        times = Track()
+        times.time = self.times
+        self.out_file.write(']}, "properties": {"name": ' +
+                json.dumps(self.name) + ', "coordTimes": ' +
+                json.dumps(times.timestamps()) + ', "speeds": ' +
+                json.dumps(self.speeds.tolist()) + '}}')
+        self.out_file.write(''.join(self.waypoints) + '\n]}\n')
+        self.waypoints = []
+
+class BinaryTrackWriter(TrackWriter):
+    '''Compact binary columnar file (.track, see Track.to_bytes), loaded
+    back with load_track without any parsing. The file holds each column
+    in one piece, so the whole track is kept in memory (about 40 bytes per
+    point) and written when closing'''
+    extension = '.track'
+    mode = 'wb'
+
+    def __init__(self, folder):
+        TrackWriter.__init__(self, folder)
+        self.track = Track()
+
+    def write_block(self, track, start, stop, timestamps):
+        if start == 0 and stop == len(track):
+            self.track.extend(track)
+        else:
+            self.track.extend(track.slice(start, stop))
+
+    def write_footer(self):
+        self.out_file.write(self.track.to_bytes())
+
+class NpzWriter(BinaryTrackWriter):
+    '''numpy .npz file with the latitude, longitude, time (seconds since
+    1970), speed, altitude and waypoint arrays, needs numpy. Like
+    BinaryTrackWriter, the whole track is kept in memory until closing'''
+    extension = '.npz'
+
+    def write_footer(self):
+        track = self.track
+        numpy.savez(self.out_file,
+                latitude=numpy.frombuffer(track.latitude, numpy.float64),
+                longitude=numpy.frombuffer(track.longitude, numpy.float64),
+                time=numpy.frombuffer(track.time, numpy.int64),
+                speed=numpy.frombuffer(track.speed, numpy.float64),
+                altitude=numpy.frombuffer(track.altitude, numpy.float64),
+                waypoint=numpy.unpackbits(
+                    numpy.frombuffer(bytes(track.waypoints), numpy.uint8),
+                    count=len(track), bitorder='little').astype(bool))
+
+# exporters by format name
+EXPORTERS = {
+    'gpx': GpxWriter,
+    'csv': CsvWriter,
+    'geojson': GeoJsonWriter,
+    'track': BinaryTrackWriter,
+    }
+if numpy is not None:
+    EXPORTERS['npz'] = NpzWriter
+
+EARTH_RADIUS = 6371000. # m
+
+def segment_distances(x, y, x0, y0, x1, y1):
+    '''Distances of the points (x, y) to the segments from (x0, y0) to
+    (x1, y1), numpy arrays'''
+    dx = x1 - x0
+    dy = y1 - y0
+    length2 = dx * dx + dy * dy
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        u = numpy.clip(((x - x0) * dx + (y - y0) * dy) / length2, 0, 1)
+    # segments of null length: distance to their start
+    u[length2 == 0] = 0
+    return numpy.hypot(x - (x0 + u * dx), y - (y0 + u * dy))
+
+def segment_distance(x, y, x0, y0, x1, y1):
+    '''Distance of the point (x, y) to the segment from (x0, y0) to
+    (x1, y1)'''
+    dx = x1 - x0
+    dy = y1 - y0
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        return math.hypot(x - x0, y - y0)
+    u = min(max(((x - x0) * dx + (y - y0) * dy) / length2, 0), 1)
+    return math.hypot(x - (x0 + u * dx), y - (y0 + u * dy))
+
+def douglas_peucker(x, y, tolerance):
+    '''Douglas-Peucker simplification of the line (x, y), in metres.
+    Returns the kept positions. With numpy, all the segments of a level are
+    split at once'''
+    if numpy is not None:
+        keep = numpy.zeros(len(x), bool)
+        keep[[0, -1]] = True
+        points = numpy.arange(len(x))
+        while True:
+            kept = numpy.flatnonzero(keep)
+            # segment of each point, between two kept points
+            segment = numpy.minimum(numpy.searchsorted(kept, points,
+                    side='right') - 1, len(kept) - 2)
+            start = kept[segment]
+            end = kept[segment + 1]
+            distances = segment_distances(x, y, x[start], y[start], x[end],
+                    y[end])
+            distances[keep] = 0
+            farthest = numpy.maximum.reduceat(distances, kept[:-1])
+            split = farthest > tolerance
+            if not split.any():
+                return kept
+            # first farthest point of each segment to split
+            candidates = numpy.flatnonzero(split[segment] &
+                    (distances == farthest[segment]))
+            first = numpy.unique(segment[candidates], return_index=True)[1]
+            keep[candidates[first]] = True
+    keep = [0, len(x) - 1]
+    segments = [(0, len(x) - 1)]
+    while segments:
+        start, end = segments.pop()
+        if end - start < 2:
+            continue
+        distance, farthest = max((segment_distance(x[position], y[position],
+                x[start], y[start], x[end], y[end]), -position)
+                for position in range(start + 1, end))
+        if distance > tolerance:
+            keep.append(-farthest)
+            segments.append((start, -farthest))
+            segments.append((-farthest, end))
+    return sorted(keep)
+
+def first_of_steps(values, step):
+    '''Positions of the first of the increasing values in each interval of
+    step, and of the last value'''
+    if numpy is not None:
+        steps = (values - values[0]) // step
+        keep = numpy.empty(len(values), bool)
+        keep[0] = True
+        keep[1:] = steps[1:] != steps[:-1]
+        keep[-1] = True
+        return numpy.flatnonzero(keep)
+    keep = [0]
+    for position in range(1, len(values)):
+        if (values[position] - values[0]) // step != \
+                (values[keep[-1]] - values[0]) // step:
+            keep.append(position)
+    if keep[-1] != len(values) - 1:
+        keep.append(len(values) - 1)
+    return keep
+
+def simplify_track(track, tolerance=None, min_interval=None,
+        min_distance=None, min_speed=None):
+    '''Returns a Track with less points. The points slower than min_speed
+    (m/s) are dropped, then the track is resampled to keep one point every
+    min_interval seconds and every min_distance metres along the track, and
+    finally it is simplified by the Douglas-Peucker algorithm with a
+    tolerance in metres. The first and last points and the waypoints are
+    always kept. The computations are done on numpy arrays if numpy is
+    available, on a local equirectangular projection'''
+    if numpy is not None:
+        waypoints = numpy.unpackbits(numpy.frombuffer(bytes(track.waypoints),
+                numpy.uint8), count=len(track), bitorder='little')
+        positions = numpy.flatnonzero(waypoints == 0)
+        latitude = numpy.frombuffer(track.latitude, numpy.float64)
+        longitude = numpy.frombuffer(track.longitude, numpy.float64)
+        speed = numpy.frombuffer(track.speed, numpy.float64)
+        seconds = numpy.frombuffer(track.time, numpy.int64)
+        cos, radians = numpy.cos, numpy.radians
+    else:
+        positions = [position for position in range(len(track))
+                if not track.is_waypoint(position)]
+        latitude, longitude = track.latitude, track.longitude
+        speed, seconds = track.speed, track.time
+        cos, radians = math.cos, math.radians
+    def project(positions):
+        # metres, on a plane tangent at the first point
+        if numpy is not None:
+            return (EARTH_RADIUS * cos(radians(latitude[positions[0]])) *
+                    radians(longitude[positions]),
+                    EARTH_RADIUS * radians(latitude[positions]))
+        scale = EARTH_RADIUS * cos(radians(latitude[positions[0]]))
+        return ([scale * radians(longitude[position])
+                    for position in positions],
+                [EARTH_RADIUS * radians(latitude[position])
+                    for position in positions])
+    def select(positions, kept):
+        if numpy is not None:
+            return positions[numpy.asarray(kept, numpy.intp)]
+        return [positions[num] for num in kept]
+    if len(positions) > 2 and min_speed:
+        kept = [num for num in range(1, len(positions) - 1)
+                if speed[positions[num]] >= min_speed] \
+                if numpy is None else \
+                numpy.flatnonzero(speed[positions[1:-1]] >= min_speed) + 1
+        positions = select(positions,
+                [0] + list(kept) + [len(positions) - 1])
+    if len(positions) > 2 and min_interval:
+        positions = select(positions, first_of_steps(seconds[positions]
+                if numpy is not None else
+                [seconds[position] for position in positions],
+                min_interval))
+    if len(positions) > 2 and min_distance:
+        x, y = project(positions)
+        if numpy is not None:
+            along = numpy.concatenate(([0.], numpy.cumsum(
+                    numpy.hypot(numpy.diff(x), numpy.diff(y)))))
+        else:
+            along = [0.]
+            for num in range(1, len(x)):
+                along.append(along[-1] + math.hypot(x[num] - x[num - 1],
+                        y[num] - y[num - 1]))
+        positions = select(positions, first_of_steps(along, min_distance))
+    if len(positions) > 2 and tolerance:
+        x, y = project(positions)
+        positions = select(positions, douglas_peucker(x, y, tolerance))
+    # the waypoints come back in their place
+    if numpy is not None:
+        positions = numpy.union1d(positions, numpy.flatnonzero(waypoints))
+    else:
+        positions = sorted(set(positions).union(position
+                for position in range(len(track))
+                if track.is_waypoint(position)))
+    return track.take(positions)
+
+class SimplifyingWriter:
+    '''Export stage simplifying a track (see simplify_track, simplify being
+    its keyword arguments) before writing it with writer. The track is kept
+    until the writer is closed, as the simplification needs all its
+    points'''
+    def __init__(self, writer, simplify):
+        self.writer = writer
+        self.simplify = simplify
+        self.track = Track()
+
+    def write(self, points):
+        if not isinstance(points, Track):
+            points = Track.from_points(points)
+        self.track.extend(points)
+
+    def close(self):
+        if len(self.track):
+            self.writer.write(simplify_track(self.track, **self.simplify))
+        return self.writer.close()
+
+    def abort(self):
+        self.writer.abort()
+
+INDEX_FOLDER = '.Py3DG200-index' # subfolder of the archive index
+INDEX_FILE = 'index.json' # all the entries without their tiles
+INDEX_TILE_SIZE = 0.01 # degrees, side of the tiles of the index grid
+
+class TrackSummary:
+    '''Bounding box, time range and grid of the points of a track, built
+    block by block as the track is written. The grid maps the (row, column)
+    tiles of tile_size degrees (None for no grid) to the runs of consecutive
+    points in them, as [start, stop, first time, last time] lists, the
+    positions counting all the points of the track, waypoints included'''
+    def __init__(self, tile_size=INDEX_TILE_SIZE):
+        self.tile_size = tile_size
+        self.points = 0
+        self.start = self.end = None
+        self.south = self.west = self.north = self.east = None
+        self.tiles = {}
+        self.last_run = None # (tile, run) of the last point
+
+    def add(self, track):
+        '''Adds the points of a Track'''
+        if not len(track):
+            return
+        if numpy is not None:
+            latitude = numpy.frombuffer(track.latitude, numpy.float64)
+            longitude = numpy.frombuffer(track.longitude, numpy.float64)
+            times = numpy.frombuffer(track.time, numpy.int64)
+            bounds = [float(latitude.min()), float(longitude.min()),
+                    float(latitude.max()), float(longitude.max()),
+                    int(times.min()), int(times.max())]
+        else:
+            bounds = [min(track.latitude), min(track.longitude),
+                    max(track.latitude), max(track.longitude),
+                    min(track.time), max(track.time)]
+        if self.points:
+            bounds = [min(bounds[0], self.south), min(bounds[1], self.west),
+                    max(bounds[2], self.north), max(bounds[3], self.east),
+                    min(bounds[4], self.start), max(bounds[5], self.end)]
+        (self.south, self.west, self.north, self.east, self.start,
+                self.end) = bounds
+        if self.tile_size:
+            self.add_tiles(track)
+        self.points += len(track)
+
+    def add_tiles(self, track):
+        size = self.tile_size
+        if numpy is not None:
+            rows = numpy.floor(numpy.frombuffer(track.latitude,
+                    numpy.float64) / size).astype(numpy.int64)
+            columns = numpy.floor(numpy.frombuffer(track.longitude,
+                    numpy.float64) / size).astype(numpy.int64)
+            changes = (numpy.flatnonzero((rows[1:] != rows[:-1]) |
+                    (columns[1:] != columns[:-1])) + 1).tolist()
+            rows = rows.tolist()
+            columns = columns.tolist()
+        else:
+            rows = [math.floor(latitude / size)
+                    for latitude in track.latitude]
+            columns = [math.floor(longitude / size)
+                    for longitude in track.longitude]
+            changes = [position for position in range(1, len(track))
+                    if rows[position] != rows[position - 1] or
+                    columns[position] != columns[position - 1]]
+        for start, stop in zip([0] + changes, changes + [len(track)]):
+            tile = (rows[start], columns[start])
+            if start == 0 and self.last_run is not None and \
+                    self.last_run[0] == tile:
+                # the run goes on from the previous block
+                run = self.last_run[1]
+                run[1] = self.points + stop
+                run[3] = track.time[stop - 1]
+            else:
+                run = [self.points + start, self.points + stop,
+                        track.time[start], track.time[stop - 1]]
+                self.tiles.setdefault(tile, []).append(run)
+            self.last_run = (tile, run)
+
+    def as_dict(self):
+        return {
+            'points': self.points,
+            'start': self.start,
+            'end': self.end,
+            'south': self.south,
+            'west': self.west,
+            'north': self.north,
+            'east': self.east,
+            'tile_size': self.tile_size,
+            'tiles': dict(('{0:d},{1:d}'.format(*tile), runs)
+                for tile, runs in self.tiles.items()),
+            }
+
+class IndexingWriter:
+    '''Export stage adding the track written by writer to the archive
+    index of its folder (see ArchiveIndex)'''
+    def __init__(self, writer, tile_size=INDEX_TILE_SIZE):
+        self.writer = writer
+        self.summary = TrackSummary(tile_size)
+
+    def write(self, points):
+        if not isinstance(points, Track):
+            points = Track.from_points(points)
+        self.summary.add(points)
+        self.writer.write(points)
+
+    def close(self):
+        result = self.writer.close()
+        if isinstance(result, tuple):
+            # fragment of a merged GPX file, indexed by write_merged_gpx
+            return result + (self.summary.as_dict(),)
+        if result is not None:
+            write_index_entries(result, [self.summary.as_dict()])
+        return result
+
+    def abort(self):
+        self.writer.abort()
+
+def write_index_json(path, value):
+    with open(path + '.tmp', 'w') as index_file:
+        json.dump(value, index_file)
+    os.replace(path + '.tmp', path)
+
+def write_index_entries(filename, summaries):
+    '''Replaces the tracks of the file filename in the archive index of its
+    folder, summaries being the dictionaries of their TrackSummary (None
+    for a track which isn't indexed). Each track has an entry,
+    <file>-<track>.json, and its tiles are in <file>-<track>.tiles.json'''
+    folder, name = os.path.split(filename)
+    index_folder = os.path.join(folder, INDEX_FOLDER)
+    os.makedirs(index_folder, exist_ok=True)
+    # the file may have had more tracks
+    prefix = name + '-'
+    for entry_name in os.listdir(index_folder):
+        number, _, extension = entry_name[len(prefix):].partition('.')
+        if entry_name.startswith(prefix) and number.isdigit() and \
+                extension in ('json', 'tiles.json'):
+            os.remove(os.path.join(index_folder, entry_name))
+    for number, summary in enumerate(summaries):
+        if summary is None:
+            continue
+        entry = dict(summary, file=name, track=number)
+        path = os.path.join(index_folder, '{0}-{1:d}'.format(name, number))
+        # the entry is only listed once its tiles are written
+        write_index_json(path + '.tiles.json', entry.pop('tiles'))
+        write_index_json(path + '.json', entry)
+
+class ArchiveIndex:
+    '''Index of the tracks exported to folder, written along with them
+    (see IndexingWriter): their bounding box, time range and grid (see
+    TrackSummary), so that they are found without being read again. The
+    tracks of the files removed since are left out. The entries are kept
+    together in INDEX_FILE, only the new or changed ones are read, and the
+    tiles of a track are only read by the queries its bounding box and time
+    range can't rule out'''
+    def __init__(self, folder):
+        self.folder = folder
+        self.index_folder = os.path.join(folder, INDEX_FOLDER)
+        index_file = os.path.join(self.index_folder, INDEX_FILE)
+        try:
+            with open(index_file, 'r') as entries_file:
+                known = json.load(entries_file)
+        except (OSError, ValueError):
+            known = {}
+        try:
+            entry_names = os.listdir(self.index_folder)
+        except OSError:
+            entry_names = []
+        # entry file name: [modification time (ns), entry]
+        entries = {}
+        for entry_name in entry_names:
+            if not entry_name.endswith('.json') or entry_name == INDEX_FILE \
+                    or entry_name.endswith('.tiles.json'):
+                continue
+            path = os.path.join(self.index_folder, entry_name)
+            try:
+                modified = os.stat(path).st_mtime_ns
+                if entry_name in known and known[entry_name][0] == modified:
+                    entry = known[entry_name][1]
+                else:
+                    with open(path, 'r') as entry_file:
+                        entry = json.load(entry_file)
+            except (OSError, ValueError):
+                continue
+            entries[entry_name] = [modified, entry]
+        if entries != known:
+            try:
+                write_index_json(index_file, entries)
+            except OSError:
+                pass
+        self.entries = [entry for modified, entry in entries.values()
+                if os.path.exists(os.path.join(folder, entry['file']))]
+        self.entries.sort(key=lambda entry: (entry['start'], entry['file'],
+                entry['track']))
+
+    def tiles(self, entry):
+        '''Returns the tiles of entry (see TrackSummary), None if they
+        can't be read. They are read from the index the first time'''
+        if 'tiles' not in entry:
+            path = os.path.join(self.index_folder, '{0}-{1:d}.tiles.json'
+                    .format(entry['file'], entry['track']))
+            try:
+                with open(path, 'r') as tiles_file:
+                    entry['tiles'] = json.load(tiles_file)
+            except (OSError, ValueError):
+                entry['tiles'] = None
+        return entry['tiles']
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def query(self, south=-90, west=-180, north=90, east=180, start=None,
+            end=None, points=False):
+        '''Returns the tracks with points in the bounding box (degrees,
+        west being less than east) and the time window (seconds since
+        1970), as (entry, ranges) tuples. entry is the dictionary of the
+        track: file, track (number of the track in the file), points,
+        start, end, south, west, north, east, tile_size and tiles (see
+        TrackSummary). With points, ranges are the (start, stop) positions
+        of the points in the tiles intersecting the bounding box, in the
+        time window, otherwise (or without grid) the whole track'''
+        results = []
+        for entry in self.entries:
+            if entry['south'] > north or entry['north'] < south or \
+                    entry['west'] > east or entry['east'] < west or \
+                    (start is not None and entry['end'] < start) or \
+                    (end is not None and entry['start'] > end):
+                continue
+            ranges = [(0, entry['points'])]
+            if entry['tile_size'] and self.tiles(entry) is not None:
+                ranges = self.query_tiles(entry, south, west, north, east,
+                        start, end)
+                if not ranges:
+                    continue
+                if not points:
+                    ranges = [(0, entry['points'])]
+            results.append((entry, ranges))
+        return results
+
+    @staticmethod
+    def query_tiles(entry, south, west, north, east, start, end):
+        '''Merged (start, stop) positions of the runs of the tiles of entry
+        in the bounding box and the time window'''
+        size = entry['tile_size']
+        rows = (math.floor(south / size), math.floor(north / size))
+        columns = (math.floor(west / size), math.floor(east / size))
+        runs = []
+        for tile, tile_runs in entry['tiles'].items():
+            row, column = (int(number) for number in tile.split(','))
+            if rows[0] <= row <= rows[1] and columns[0] <= column <= columns[1]:
+                runs.extend(run[:2] for run in tile_runs
+                        if (start is None or run[3] >= start) and
+                        (end is None or run[2] <= end))
+        ranges = []
+        for run_start, run_stop in sorted(runs):
+            if ranges and run_start <= ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], run_stop))
+            else:
+                ranges.append((run_start, run_stop))
+        return ranges
+
+def make_writer(folder, export_format='gpx', merge=False, simplify=None):
+    '''Writer of a track in folder, in one of the EXPORTERS formats, or a
+    GpxFragmentWriter with merge, simplifying the track with the
+    simplify_track keyword arguments of simplify, if given. The track is
+    added to the archive index of the folder (see ArchiveIndex)'''
+    writer = GpxFragmentWriter(folder) if merge else \
+            EXPORTERS[export_format](folder)
+    writer = IndexingWriter(writer)
+    if simplify:
+        writer = SimplifyingWriter(writer, simplify)
+    return writer
+
+def write_gpx(folder, track):
+    '''Writes a Track or an iterable of points to a GPX file in folder'''
+    writer = GpxWriter(folder)
+    try:
+        writer.write(track)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
+
+def export_track(folder, track, export_format='gpx', simplify=None):
+    '''Writes a Track or an iterable of points to a file in folder (see
+    make_writer). Returns the file name'''
+    writer = make_writer(folder, export_format, simplify=simplify)
+    try:
+        writer.write(track)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
+
+def load_track(filename):
+    '''Reads a Track written by the track or npz exporter'''
+    if filename.endswith('.npz'):
+        with numpy.load(filename) as columns:
+            track = Track()
+            for column in ('latitude', 'longitude', 'time', 'speed',
+                    'altitude'):
+                getattr(track, column).frombytes(columns[column].tobytes())
+            track.waypoints = bytearray(numpy.packbits(columns['waypoint'],
+                    bitorder='little').tobytes())
+            return track
+    with open(filename, 'rb') as track_file:
+        return Track.from_bytes(track_file.read())
+
+
+def cache_folder():
+    '''Default folder of the caches'''
+    return os.path.join(os.environ.get('XDG_CACHE_HOME',
+            os.path.expanduser('~/.cache')), 'Py3DG200')
+
+class TrackCache:
+    '''On-disk cache of the downloaded track parts. Each part is stored
+    twice: its raw payload (.bin) and its decoded Track (.track), under a key
+    made of its header index and its header date and time. Each device has
+    its own subfolder'''
+    def __init__(self, folder=None, device=None):
+        if folder is None:
+            folder = cache_folder()
+        if device is not None:
+            folder = os.path.join(folder, device)
+        self.folder = folder
+        os.makedirs(self.folder, exist_ok=True)
+
+    @staticmethod
+    def key(index, date, time):
+        '''Cache key of a track part from its header index, date (ddmmyy)
+        and time (hhmmss)'''
+        return '{0:d}-{1:06d}-{2:06d}'.format(index, date, time)
+
+    @staticmethod
+    def header_keys(headers):
+        '''Cache keys of headers (as returned by DG200.get_headers), by
+        header index. The last part may still get new points: it never
+        gets a key so that it's always downloaded'''
+        return dict((index, TrackCache.key(index, date, htime))
+                for index, date, htime, first in headers[:-1])
+
+    def path(self, key, extension):
+        return os.path.join(self.folder, key + extension)
+
+    def __contains__(self, key):
+        return key is not None and os.path.exists(self.path(key, '.bin'))
+
+    def get_raw(self, key):
+        '''Returns the raw payload of a part, None if it isn't cached'''
+        if key not in self:
+            return None
+        with open(self.path(key, '.bin'), 'rb') as raw_file:
+            return raw_file.read()
+
+    def get_track(self, key):
+        '''Returns the decoded Track of a part, None if it isn't cached'''
+        if key not in self:
+            return None
+        try:
+            with open(self.path(key, '.track'), 'rb') as track_file:
+                return Track.from_bytes(track_file.read())
+        except (OSError, ValueError, struct.error):
+            # decode again from the raw payload
+            return decode_track(memoryview(self.get_raw(key)))
+
+    def put(self, key, raw, track):
+        '''Stores a part. The raw payload is written last, so that a part
+        is only seen as cached once both files are complete'''
+        for extension, data in (('.track', track.to_bytes()), ('.bin', raw)):
+            with open(self.path(key, extension) + '.tmp', 'wb') as cache_file:
+                cache_file.write(data)
+            os.replace(self.path(key, extension) + '.tmp',
+                    self.path(key, extension))
+
+class DownloadCheckpoint:
+    '''Progress of a download into folder, saved as it goes so that an
+    interrupted download can be resumed: each track part is stored by
+    header index in a hidden subfolder as soon as it's received, and the
+    download (device, headers, sessions and export settings) is described
+    in a JSON file next to it. Both are removed by finish, once all the
+    files are written'''
+    name = '.Py3DG200-download'
+
+    def __init__(self, folder):
+        self.folder = os.path.join(folder, self.name)
+        self.state_file = self.folder + '.json'
+        self.keys = {}
+        try:
+            with open(self.state_file, 'r') as state_file:
+                self.state = json.load(state_file)
+        except (OSError, ValueError):
+            # no interrupted download
+            self.state = None
+
+    def start(self, device, headers, sessions, export_format='gpx',
+            merge=False, simplify=None):
+        '''Starts the download of sessions (lists of header indices) from
+        device, whose headers are as returned by DG200.get_headers. The
+        parts of an interrupted download are kept if they are still on
+        the device, except the last one which may have new points'''
+        self.state = {
+            'device': device,
+            'headers': [list(header) for header in headers],
+            'sessions': [list(list_index) for list_index in sessions],
+            'export_format': export_format,
+            'merge': merge,
+            'simplify': simplify,
+            }
+        self.keys = dict((index, TrackCache.key(index, date, htime))
+                for index, date, htime, first in headers)
+        kept = set(key + '.bin' for key in
+                TrackCache.header_keys(headers).values())
+        os.makedirs(self.folder, exist_ok=True)
+        for name in os.listdir(self.folder):
+            if name not in kept:
+                os.remove(os.path.join(self.folder, name))
+        with open(self.state_file + '.tmp', 'w') as state_file:
+            json.dump(self.state, state_file)
+        os.replace(self.state_file + '.tmp', self.state_file)
+
+    def resume(self, device, headers):
+        '''Starts the interrupted download again, returns its sessions, or
+        None if there is none for device or if its parts are no longer on
+        the device'''
+        if self.state is None or self.state['device'] != device:
+            return None
+        keys = dict((index, TrackCache.key(index, date, htime))
+                for index, date, htime, first in headers)
+        for index, date, htime, first in self.state['headers']:
+            if keys.get(index) != TrackCache.key(index, date, htime):
+                # the memory was cleared or overwritten since
+                return None
+        sessions = self.state['sessions']
+        self.start(device, headers, sessions, self.state['export_format'],
+                self.state['merge'], self.state['simplify'])
+        return sessions
+
+    def path(self, index):
+        return os.path.join(self.folder, self.keys[index] + '.bin')
+
+    def get(self, index):
+        '''Returns the raw payload of a part received before, None if it
+        wasn't'''
+        try:
+            with open(self.path(index), 'rb') as part_file:
+                return part_file.read()
+        except OSError:
+            return None
+
+    def put(self, index, raw):
+        '''Stores the raw payload of a part'''
+        with open(self.path(index) + '.tmp', 'wb') as part_file:
+            part_file.write(raw)
+        os.replace(self.path(index) + '.tmp', self.path(index))
+
+    def finish(self):
+        '''Removes the checkpoint of a completed download'''
+        shutil.rmtree(self.folder, ignore_errors=True)
+        try:
+            os.remove(self.state_file)
+        except OSError:
+            pass
+        self.state = None
+
+
+CONFIGURATION_TYPES = {
+    'format': int, # 1: position, time, date, speed; 2: with altitude
+    'disable_speed': bool,
+    'speed_threshold': int, # km/h
+    'disable_distance': bool,
+    'distance_threshold': int, # m
+    'time_interval': float, # s
+    'by_distance': bool,
+    'distance_interval': int, # m
+    'waas': bool,
+    }
+
+class Configuration:
+    '''Configuration of the device, with the settings of
+    CONFIGURATION_TYPES as attributes, and memory_usage (%, None if
+    unknown), which can only be read. The 0xB7 answer and the 0xB8 command
+    share the same layout, after their command byte'''
+    __slots__ = tuple(CONFIGURATION_TYPES) + ('memory_usage',)
+    # command byte, format, speed threshold flag and value, distance
+    # threshold flag and value, time interval (ms), interval by
+    # time/distance flag (unused bytes around), distance interval,
+    # operation mode, WAAS flag
+    codec = struct.Struct('>BBBIBII10xB2xI8xBB')
+    # (lowest, highest) values of the numeric settings, as encoded
+    limits = {
+        'format': (0, 0xFF),
+        'speed_threshold': (0, 0xFFFFFFFF),
+        'distance_threshold': (0, 0xFFFFFFFF),
+        'time_interval': (0, 0xFFFFFFFF / 1000),
+        'distance_interval': (0, 0xFFFFFFFF),
+        }
+
+    def __init__(self, memory_usage=None, **settings):
+        for key, setting_type in CONFIGURATION_TYPES.items():
+            setattr(self, key, self.check(key,
+                    setting_type(settings.pop(key, 0))))
+        if settings:
+            raise TypeError('unknown settings ' + ', '.join(settings))
+        self.memory_usage = memory_usage
+
+    @classmethod
+    def check(cls, key, value):
+        '''Returns value, raises ValueError if it can't be encoded as the
+        setting key'''
+        if key in cls.limits:
+            lowest, highest = cls.limits[key]
+            if not lowest <= value <= highest:
+                raise ValueError('{0} out of range: {1} (expected {2} to '
+                        '{3})'.format(key, value, lowest, highest))
+        return value
+
+    @classmethod
+    def decode(cls, conf):
+        '''Decodes the answer of the 0xB7 command'''
+        (command, point_format, disable_speed, speed_threshold,
+                disable_distance, distance_threshold, time_interval,
+                by_distance, distance_interval, mode,
+                waas) = cls.codec.unpack_from(conf)
+        return cls(format=point_format, disable_speed=disable_speed == 1,
+                speed_threshold=speed_threshold,
+                disable_distance=disable_distance == 1,
+                distance_threshold=distance_threshold,
+                time_interval=time_interval / 1000,
+                by_distance=by_distance != 0,
+                distance_interval=distance_interval, waas=waas == 1,
+                memory_usage=conf[cls.codec.size]
+                    if len(conf) > cls.codec.size else None)
+
+    def encode(self):
+        '''Builds the 0xB8 command payload'''
+        return self.codec.pack(0xB8, self.format, self.disable_speed,
+                self.speed_threshold, self.disable_distance,
+                self.distance_threshold, int(round(1000 * self.time_interval)),
+                self.by_distance, self.distance_interval,
+                # Operation mode should be 4
+                4, self.waas)
+
+    def as_dict(self):
+        '''The settings and memory_usage as a dictionary'''
+        return dict((key, getattr(self, key)) for key in self.__slots__)
+
+    def __eq__(self, other):
+        '''Configurations are equal if they have the same settings'''
+        if not isinstance(other, Configuration):
+            return NotImplemented
+        return self.encode() == other.encode()
+
+    def __repr__(self):
+        return 'Configuration(' + ', '.join(key + '=' + repr(value)
+                for key, value in self.as_dict().items()) + ')'
+
+def decode_configuration(conf):
+    '''Decodes the answer of the 0xB7 command into a dictionary with the
+    keys of CONFIGURATION_TYPES and memory_usage (%)'''
+    return Configuration.decode(conf).as_dict()
+
+def encode_configuration(settings):
+    '''Builds the 0xB8 command payload from a configuration dictionary'''
+    return Configuration(**settings).encode()
+
+def format_header_date(date):
+    '''dd/mm/yy string of a header date'''
+    date = '{0:0>6d}'.format(date)
+    return '/'.join([date[0:2], date[2:4], date[4:6]])
+
+def format_header_time(htime):
+    '''hh:mm:ss string of a header time'''
+    htime = '{0:0>6d}'.format(htime)
+    return ':'.join([htime[0:2], htime[2:4], htime[4:6]])
+
+def group_sessions(headers):
+    '''Groups headers (as returned by DG200.get_headers) into sessions, a
+    session being the list of its headers'''
+    sessions = []
+    for header in headers:
+        if header[3] or not sessions:
+            # header is first in its session
+            sessions.append([header])
+        else:
+            sessions[-1].append(header)
+    return sessions
+
+class HeaderTable:
+    '''Headers of the track parts (as returned by DG200.get_headers),
+    grouped into sessions by their first in session flag. Sessions are
+    numbered from 0, in memory order; the headers of a session and the
+    session of a header index are found without scanning the table. Headers
+    can be added page by page while they are read from the device'''
+    def __init__(self, headers=()):
+        self.headers = []
+        self.starts = [] # position of the first header of each session
+        self.positions = {} # header index: position
+        self.sessions = {} # header index: session
+        self.extend(headers)
+
+    def extend(self, headers):
+        '''Adds headers at the end of the table, returns the range of the
+        sessions which were created or got new parts'''
+        first = max(len(self.starts) - 1, 0)
+        for header in headers:
+            if header[3] or not self.starts:
+                # header is first in its session
+                self.starts.append(len(self.headers))
+            self.positions[header[0]] = len(self.headers)
+            self.sessions[header[0]] = len(self.starts) - 1
+            self.headers.append(header)
+        return range(first, len(self.starts))
+
+    def __len__(self):
+        '''Number of sessions'''
+        return len(self.starts)
+
+    def __getitem__(self, session):
+        '''Headers of a session'''
+        return self.headers[self.starts[session]:self.stop(session)]
+
+    def __iter__(self):
+        for session in range(len(self)):
+            yield self[session]
+
+    def stop(self, session):
+        if session + 1 < len(self.starts):
+            return self.starts[session + 1]
+        return len(self.headers)
+
+    def first(self, session):
+        '''Header of the first part of a session'''
+        return self.headers[self.starts[session]]
+
+    def size(self, session):
+        '''Number of parts of a session'''
+        return self.stop(session) - self.starts[session]
+
+    def indices(self, session):
+        '''Header indices of the parts of a session'''
+        return [header[0] for header in self[session]]
+
+    def session_of(self, index):
+        '''Session of a header index, None if it isn't in the table'''
+        return self.sessions.get(index)
+
+    def key(self, index):
+        '''Cache key of a header index, see TrackCache.header_keys'''
+        position = self.positions.get(index)
+        if position is None or position == len(self.headers) - 1:
+            return None
+        index, date, htime, first = self.headers[position]
+        return TrackCache.key(index, date, htime)
+
+    def keys(self, start=0):
+        '''Cache keys by header index of the headers from position start,
+        see TrackCache.header_keys'''
+        return TrackCache.header_keys(self.headers[start:])
+
+    def is_new(self, session, cache):
+        '''Whether a session has parts which are not in cache'''
+        return any(self.key(index) not in cache
+                for index in self.indices(session))
+
+def list_serial_ports():
+    '''Returns the USB serial ports as a {port: hardware id} dictionary'''
+    ports = dict((port.device, port.hwid) for port in list_ports.comports()
+            if 'USB' in port.hwid)
+    if not ports:
+        # no sysfs information, fall back to the device names
+        ports = dict((port, port) for port in
+                glob.glob('/dev/ttyUSB*') + glob.glob('/dev/ttyACM*'))
+    return ports
+
+def probe_device(port, timeout=0.2):
+    '''Returns the ID of the DG200 on port, None if there is none'''
+    test = DG200(timeout)
+    # a port without a DG200 isn't asked again
+    test.max_retries = 0
+    try:
+        if test.connect(port):
+            return test.get_id() or None
+    except:
+        pass
+    finally:
+        test.close()
+    return None
+
+def detect_devices(probe_timeout=0.2, use_cache=True):
+    '''Returns the list of the ports where a DG200 answers. All the ports
+    are probed at once, with a short timeout. Ports already known to be a
+    DG200 with the same hardware id are not probed again, if this id holds
+    the serial number of the adapter (otherwise another adapter of the same
+    model could have taken the port)'''
+    ports = list_serial_ports()
+    known_file = os.path.join(cache_folder(), 'ports.json')
+    known = {}
+    if use_cache:
+        try:
+            with open(known_file, 'r') as ports_file:
+                known = json.load(ports_file)
+        except (OSError, ValueError):
+            pass
+    list_ttyUSB = [port for port in ports if 'SER=' in ports[port] and
+            port in known and known[port]['hwid'] == ports[port]]
+    to_probe = [port for port in ports if port not in list_ttyUSB]
+    if to_probe:
+        with concurrent.futures.ThreadPoolExecutor(len(to_probe)) as executor:
+            ids = executor.map(probe_device, to_probe,
+                    [probe_timeout] * len(to_probe))
+            for port, device_id in zip(to_probe, ids):
+                known.pop(port, None)
+                if device_id:
+                    list_ttyUSB.append(port)
+                    known[port] = {'hwid': ports[port],
+                            'id': bytes(device_id).hex()}
+    if use_cache:
+        # forget the ports which disappeared
+        known = dict((port, known[port]) for port in known if port in ports)
+        try:
+            os.makedirs(cache_folder(), exist_ok=True)
+            with open(known_file, 'w') as ports_file:
+                json.dump(known, ports_file)
+        except OSError:
+            pass
+    return sorted(list_ttyUSB)
+
+def fetch_track_part(dg200, index, key, cache, checkpoint, progress):
+    '''Returns the (key, payload) tuple of a track part, the payload being
+    None if the part is cached. A part received by an interrupted download
+    is read from checkpoint, the other ones are downloaded and stored in
+    checkpoint, if given'''
+    if cache is not None and key in cache:
+        # already downloaded during a previous run
+        if progress:
+            progress(2)
+        return key, None
+    track_raw = None if checkpoint is None else checkpoint.get(index)
+    if track_raw is not None:
+        if progress:
+            progress(2)
+        return key, track_raw
+    track_raw = dg200.get_track_part(index, progress)
+    if track_raw is None:
+        raise IOError("Can't download track part " + str(index))
+    if checkpoint is not None:
+        checkpoint.put(index, track_raw)
+    return key, track_raw
+
+def read_track_parts(dg200, list_index, keys, cache, progress, cancel,
+        parts, stop, checkpoint=None):
+    '''Reader stage of download_track: downloads the track parts which
+    aren't cached and puts (key, payload) tuples in the parts queue (payload
+    being None for cached parts), then None at the end, or the exception
+    which stopped it'''
+    try:
+        for index in list_index:
+            if stop.is_set() or (cancel is not None and cancel.is_set()):
+                break
+            key = None if keys is None else keys.get(index)
+            parts.put(fetch_track_part(dg200, index, key, cache, checkpoint,
+                    progress))
+        parts.put(None)
+    except Exception as error:
+        parts.put(error)
+
+def download_track(dg200, list_index, folder, keys=None, cache=None,
+        progress=None, cancel=None, export_format='gpx', simplify=None,
+        checkpoint=None):
+    '''Downloads the track parts of list_index into a file in folder (see
+    make_writer), reading the next part while the previous one is written.
+    keys maps header indices to cache keys, progress gets the received
+    halves of parts, cancel stops before the next part and checkpoint
+    stores the received parts. Returns the file name'''
+    writer = make_writer(folder, export_format, simplify=simplify)
+    parts = queue.Queue(maxsize=4)
+    stop = threading.Event()
+    reader = threading.Thread(target=read_track_parts, args=(dg200,
+            list_index, keys, cache, progress, cancel, parts, stop,
+            checkpoint), daemon=True)
+    reader.start()
+    metrics = dg200.metrics
+    try:
+        while True:
+            wait_start = time.perf_counter()
+            item = parts.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            key, track_raw = item
+            decode_start = time.perf_counter()
+            if track_raw is None:
+                track = cache.get_track(key)
+                stage = 'cache'
+            else:
+                track = decode_track(memoryview(track_raw))
+                stage = 'decode'
+                if cache is not None and key is not None:
+                    cache.put(key, track_raw, track)
+            if isDebug:
+                print("refined track part = " + str(list(track.points())))
+            export_start = time.perf_counter()
+            # points are written while the next parts are downloaded
+            writer.write(track)
+            if metrics is not None:
+                # waiting for parts means the device is the bottleneck
+                metrics.stage('wait', decode_start - wait_start)
+                metrics.stage(stage, export_start - decode_start, len(track))
+                metrics.stage('export', time.perf_counter() - export_start,
+                        len(track))
+        if cancel is not None and cancel.is_set():
+            writer.abort()
+            return None
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        # let the reader finish its current part
+        stop.set()
+        while reader.is_alive():
+            try:
+                parts.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    return writer.close()
+
+def download_device(port, folder, cache_folder=None, new=False,
+        progress=None, cancel=None, export_format='gpx', metrics=None,
+        simplify=None, resume=False, clear=False):
+    '''Downloads the tracks of the DG200 on port into a subfolder of folder
+    named after the device, only those with parts not in the cache with
+    new. With resume, the interrupted download is finished instead, with
+    clear the memory is erased once archived (see is_archived). Returns the
+    list of exported files'''
+    dg200 = DG200(metrics=metrics)
+    if not dg200.connect(port):
+        return []
+    try:
+        name = dg200.get_name()
+        cache = TrackCache(cache_folder, name)
+        subfolder = os.path.join(folder, name)
+        os.makedirs(subfolder, exist_ok=True)
+        headers = dg200.get_headers()
+        table = HeaderTable(headers)
+        keys = table.keys()
+        checkpoint = DownloadCheckpoint(subfolder)
+        sessions = checkpoint.resume(name, headers) if resume else None
+        if sessions is not None:
+            export_format = checkpoint.state['export_format']
+            simplify = checkpoint.state['simplify']
+        elif resume:
+            print("Warning: no download of " + name + " to resume")
+            return []
+        else:
+            sessions = [table.indices(session)
+                    for session in range(len(table))
+                    if not new or table.is_new(session, cache)]
+            checkpoint.start(name, headers, sessions, export_format,
+                    simplify=simplify)
+        total = 2 * sum(len(session) for session in sessions)
+        received = [0]
+        def part_received(halves):
+            received[0] += halves
+            progress(port, received[0], total)
+        if progress:
+            progress(port, 0, total)
+        filenames = []
+        exported = set()
+        for session in sessions:
+            if cancel is not None and cancel.is_set():
+                break
+            filename = download_track(dg200, session, subfolder, keys,
+                    cache, part_received if progress else None, cancel,
+                    export_format, simplify, checkpoint)
+            if filename is not None:
+                filenames.append(filename)
+                exported.update(session)
+        if cancel is None or not cancel.is_set():
+            checkpoint.finish()
+            if clear and is_archived(dg200, headers, cache, exported):
+                if dg200.clear_memory():
+                    print("Memory of " + name + " cleared")
+                else:
+                    print("Warning: can't clear the memory of " + name)
+        # get configuration for the diode to switch on
+        dg200.get_configuration()
+        return filenames
+    finally:
+        dg200.close()
+
+def is_archived(dg200, headers, cache, exported):
+    '''Whether all the track parts of the device are archived, so that
+    its memory can be cleared: its headers must still be headers (no part
+    was added during the download) and all the parts must be in cache or
+    in exported, the header indices of the files written by the download.
+    The last part, which is never cached, must be in exported'''
+    if not headers:
+        return False
+    if dg200.get_headers() != headers:
+        print("Warning: new track parts since the download")
+        return False
+    keys = TrackCache.header_keys(headers)
+    missing = [index for index, date, htime, first in headers
+            if keys.get(index) not in cache and index not in exported]
+    if headers[-1][0] not in exported:
+        missing.append(headers[-1][0])
+    if missing:
+        print("Warning: track parts not archived: " +
+                ', '.join(str(index) for index in sorted(set(missing))))
+        return False
+    return True
+
+def download_devices(ports, folder, cache_folder=None, new=False,
+        progress=None, cancel=None, export_format='gpx', metrics=None,
+        simplify=None, resume=False):
+    '''Downloads from several devices at once, with one thread per port
+    (see download_device). Returns the list of exported files of each
+    port'''
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max(len(ports), 1)) as executor:
+        futures = dict((port, executor.submit(download_device, port, folder,
+                cache_folder, new, progress, cancel, export_format, metrics,
+                simplify, resume))
+                for port in ports)
+        for port, future in futures.items():
+            try:
+                results[port] = future.result()
+            except Exception as error:
+                print("Warning: download from " + port + " failed: " +
+                        str(error))
+                results[port] = []
+    return results
+
+class DownloadProgress:
+    '''Progress callback of download_devices, combining the progress of all
+    the devices before calling callback with (received, total)'''
+    def __init__(self, callback):
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.devices = {}
+
+    def __call__(self, port, received, total):
+        with self.lock:
+            self.devices[port] = (received, total)
+            received = sum(device[0] for device in self.devices.values())
+            total = sum(device[1] for device in self.devices.values())
+        self.callback(received, total)
+
+class DeviceWatcher:
+    '''Service downloading the new tracks of the DG200 as they are
+    plugged in: the USB serial ports are listed every interval seconds, the
+    new ones are probed with the 0xBF command and the new tracks of each
+    DG200 are downloaded into folder, in a thread per device (see
+    download_device, whose arguments are given by options). A device is
+    only synchronised again once unplugged and plugged back. Runs until
+    stop is called'''
+    probe_attempts = 3 # a device just plugged may not answer at once
+    probe_timeout = 1
+
+    def __init__(self, folder, interval=2, **options):
+        self.folder = folder
+        self.interval = interval
+        self.options = options
+        self.stop_event = threading.Event()
+        self.ports = {} # ports already seen, with their hardware id
+        self.threads = {}
+
+    def stop(self):
+        self.stop_event.set()
+
+    def poll(self):
+        '''Starts the synchronisation of the ports plugged since the last
+        poll'''
+        ports = list_serial_ports()
+        for port in list(self.ports):
+            if ports.get(port) != self.ports[port]:
+                # unplugged (or another device on the same port)
+                del self.ports[port]
+        for port, hwid in ports.items():
+            thread = self.threads.get(port)
+            if port in self.ports or (thread is not None and
+                    thread.is_alive()):
+                continue
+            self.ports[port] = hwid
+            self.threads[port] = threading.Thread(target=self.synchronise,
+                    args=(port,), daemon=True)
+            self.threads[port].start()
+
+    def synchronise(self, port):
+        '''Downloads the new tracks of the DG200 on port, if there is one,
+        run in a separate thread'''
+        for attempt in range(self.probe_attempts):
+            device_id = probe_device(port, self.probe_timeout)
+            if device_id is not None or self.stop_event.wait(self.interval):
+                break
+        if device_id is None:
+            return
+        print("DG200 on " + port + ", synchronising")
+        try:
+            filenames = download_device(port, self.folder, new=True,
+                    cancel=self.stop_event, **self.options)
+        except Exception as error:
+            # unplugged during the download: the received parts are kept
+            # for the next time (see DownloadCheckpoint)
+            print("Warning: download from " + port + " failed: " + str(error))
+            return
+        for filename in filenames:
+            print(filename)
+        print("DG200 on " + port + " synchronised")
+
+    def run(self):
+        '''Polls the ports until stop is called (or an exception, such as
+        KeyboardInterrupt, is raised), then waits for the current downloads
+        to stop at the end of their track part'''
+        try:
+            while True:
+                self.poll()
+                if self.stop_event.wait(self.interval):
+                    break
+        finally:
+            self.stop_event.set()
+            for thread in self.threads.values():
+                thread.join()
+
+class DumpWriter:
+    '''Writes raw track parts, as received from the device, one after the
+    other in a dump file. The index of the parts (header, offset, length
+    and point format) is written next to it, in filename + '.json', when
+    closing'''
+    def __init__(self, filename, device=None):
+        self.filename = filename
+        self.device = device
+        self.parts = []
+        self.offset = 0
+        self.dump_file = open(filename, 'wb', buffering=2**20)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, header, raw):
+        '''Adds the payload of the track part of header (see
+        parse_headers)'''
+        index, date, htime, first = header
+        self.dump_file.write(raw)
+        self.parts.append({'index': index, 'date': date, 'time': htime,
+                'first': first, 'offset': self.offset, 'length': len(raw),
+                'format': bytes2int(raw[28:32]) if len(raw) >= 32 else 0})
+        self.offset += len(raw)
+
+    def close(self):
+        if self.dump_file is None:
+            return
+        self.dump_file.close()
+        self.dump_file = None
+        with open(self.filename + '.json.tmp', 'w') as index_file:
+            json.dump({'device': self.device, 'parts': self.parts},
+                    index_file)
+        os.replace(self.filename + '.json.tmp', self.filename + '.json')
+
+def dump_memory(dg200, filename, cache=None, progress=None, cancel=None):
+    '''Downloads all the track parts of the device into a dump file (see
+    DumpWriter), without decoding them. Parts found in cache aren't
+    downloaded again. progress and cancel are as for download_track.
+    Returns the number of dumped parts'''
+    headers = dg200.get_headers()
+    keys = TrackCache.header_keys(headers)
+    with DumpWriter(filename, dg200.get_name()) as writer:
+        for header in headers:
+            if cancel is not None and cancel.is_set():
+                break
+            key = keys.get(header[0])
+            if cache is not None and key in cache:
+                track_raw = cache.get_raw(key)
+                if progress:
+                    progress(2)
+            else:
+                track_raw = dg200.get_track_part(header[0], progress)
+                if track_raw is None:
+                    raise IOError("Can't download track part " +
+                            str(header[0]))
+            writer.write(header, track_raw)
+        return len(writer.parts)
+
+class MemoryDump:
+    '''Dump file written by DumpWriter, mapped in memory: the track parts
+    are decoded from memoryviews on the mapping, without reading or copying
+    the file'''
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename + '.json', 'r') as index_file:
+            index = json.load(index_file)
+        self.device = index['device']
+        self.parts = index['parts']
+        self.headers = HeaderTable((part['index'], part['date'],
+                part['time'], part['first']) for part in self.parts)
+        with open(filename, 'rb') as dump_file:
+            if os.fstat(dump_file.fileno()).st_size:
+                self.map = mmap.mmap(dump_file.fileno(), 0,
+                        access=mmap.ACCESS_READ)
+            else:
+                # empty files can't be mapped
+                self.map = b''
+        self.view = memoryview(self.map)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.view.release()
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+
+    def part(self, index):
+        '''Payload of the track part of a header index, as a memoryview'''
+        part = self.parts[self.headers.positions[index]]
+        return self.view[part['offset']:part['offset'] + part['length']]
+
+    def tracks(self, session):
+        '''Iterates over the decoded Tracks of the parts of a session'''
+        for index in self.headers.indices(session):
+            yield decode_track(self.part(index))
+
+    def export_session(self, session, folder, export_format='gpx',
+            merge=False, simplify=None):
+        '''Writes a session to a file in folder, see export_parts'''
+        writer = make_writer(folder, export_format, merge, simplify)
+        try:
+            for track in self.tracks(session):
+                writer.write(track)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
+
+    def export(self, folder, sessions=None, export_format='gpx', workers=1,
+            merge=False, simplify=None):
+        '''Writes the sessions (all by default) to files in folder (see
+        make_writer), in parallel with several workers (all the cores for
+        None). With merge, all the sessions go to one GPX file. Returns the
+        file names'''
+        if merge and export_format != 'gpx':
+            raise ValueError('only GPX files can be merged')
+        if sessions is None:
+            sessions = range(len(self.headers))
+        if workers == 1:
+            results = [self.export_session(session, folder, export_format,
+                    merge, simplify) for session in sessions]
+        else:
+            with export_pool(workers, open_dump_worker,
+                    (self.filename,)) as pool:
+                results = list(pool.map(export_dump_session, sessions,
+                        itertools.repeat(folder),
+                        itertools.repeat(export_format),
+                        itertools.repeat(merge), itertools.repeat(simplify)))
+        if merge:
+            return [write_merged_gpx(folder, results)]
+        return results
+
+def export_pool(workers=None, initializer=None, initargs=()):
+    '''Process pool of the parallel exports, with workers processes (all
+    the cores for None). The processes are spawned rather than forked, as
+    forking a process with threads (the GUI, the download threads) isn't
+    safe'''
+    return concurrent.futures.ProcessPoolExecutor(workers,
+            multiprocessing.get_context('spawn'), initializer, initargs)
+
+# dump mapped by each process of an export pool
+dump_worker = None
+
+def open_dump_worker(filename):
+    global dump_worker
+    dump_worker = MemoryDump(filename)
+
+def export_dump_session(session, folder, export_format, merge, simplify):
+    return dump_worker.export_session(session, folder, export_format, merge,
+            simplify)
+
+def export_parts(folder, parts, export_format='gpx', cache_folder=None,
+            merge=False, simplify=None):
+    '''Decodes track parts, (cache key, payload) tuples whose payload is
+    None if cached, and writes them to a file in folder (see make_writer);
+    run by the processes of download_sessions. Returns the file name (or
+    fragment) and the (stage, duration, points) given to Metrics.stage'''
+    cache = None if cache_folder is None else TrackCache(cache_folder)
+    writer = make_writer(folder, export_format, merge, simplify)
+    stages = []
+    try:
+        for key, track_raw in parts:
+            decode_start = time.perf_counter()
+            if track_raw is None:
+                track = cache.get_track(key)
+                stage = 'cache'
+            else:
+                track = decode_track(memoryview(track_raw))
+                stage = 'decode'
+                if cache is not None and key is not None:
+                    cache.put(key, track_raw, track)
+            export_start = time.perf_counter()
+            writer.write(track)
+            stages.append((stage, export_start - decode_start, len(track)))
+            stages.append(('export', time.perf_counter() - export_start,
+                    len(track)))
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close(), stages
+
+def download_sessions(dg200, sessions, folder, keys=None, cache=None,
+        progress=None, cancel=None, export_format='gpx', workers=None,
+            merge=False, simplify=None, checkpoint=None):
+    '''Downloads sessions (lists of header indices) to files in folder, as
+    download_track, a pool of processes exporting each session while the
+    next one is downloaded. With merge, all the sessions go to one GPX
+    file. Returns the file names'''
+    if merge and export_format != 'gpx':
+        raise ValueError('only GPX files can be merged')
+    cache_folder = None if cache is None else cache.folder
+    with export_pool(workers) as pool:
+        futures = []
+        for list_index in sessions:
+            parts = []
+            for index in list_index:
+                if cancel is not None and cancel.is_set():
+                    break
+                key = None if keys is None else keys.get(index)
+                parts.append(fetch_track_part(dg200, index, key, cache,
+                        checkpoint, progress))
+            if cancel is not None and cancel.is_set():
+                # the session isn't complete
+                break
+            futures.append(pool.submit(export_parts, folder, parts,
+                    export_format, cache_folder, merge, simplify))
+        results = []
+        for future in futures:
+            result, stages = future.result()
+            results.append(result)
+            if dg200.metrics is not None:
+                # measured by the process which exported the session
+                for stage in stages:
+                    dg200.metrics.stage(*stage)
+    if merge:
+        return [write_merged_gpx(folder, results)]
+    return results
+
+class Metrics:
+    '''Instrumentation of the exchanges with the devices and of the
+    download stages. The DG200 classes report each answer (or failure) with
+    command(), download_track reports the time spent waiting for the
+    device, reading the cache, decoding and exporting with stage(). Each
+    record is a dictionary given to callback and written as a JSON line to
+    the log file, if any. summary() returns the totals by command opcode
+    and by stage. Metrics can be shared by several devices and threads'''
+    def __init__(self, callback=None, log=None):
+        self.callback = callback
+        self.log_file = open(log, 'a', buffering=1) if log else None
+        self.lock = threading.Lock()
+        self.commands = {}
+        self.stages = {}
+
+    def record(self, record):
+        record['time'] = time.time()
+        if self.callback:
+            self.callback(record)
+        if self.log_file is not None:
+            with self.lock:
+                self.log_file.write(json.dumps(record) + '\n')
+
+    def command(self, port, exchange, ok):
+        '''Records the answer to a command, see Exchange'''
+        latency = time.perf_counter() - exchange.start
+        opcode = '{0:02X}'.format(exchange.opcode)
+        with self.lock:
+            totals = self.commands.setdefault(opcode, dict.fromkeys((
+                    'count', 'failures', 'latency', 'max_latency', 'sent',
+                    'received', 'busy', 'checksum_errors', 'retries'), 0))
+            totals['count'] += 1
+            totals['failures'] += not ok
+            totals['latency'] += latency
+            totals['max_latency'] = max(totals['max_latency'], latency)
+            for counter in ('sent', 'received', 'busy', 'checksum_errors',
+                    'retries'):
+                totals[counter] += getattr(exchange, counter)
+        self.record({'event': 'command', 'port': port, 'opcode': opcode,
+                'ok': ok, 'latency': latency, 'sent': exchange.sent,
+                'received': exchange.received, 'busy': exchange.busy,
+                'checksum_errors': exchange.checksum_errors,
+                'retries': exchange.retries})
+
+    def stage(self, name, duration, points=0):
+        '''Records the duration (s) of a download stage'''
+        with self.lock:
+            totals = self.stages.setdefault(name,
+                    {'count': 0, 'duration': 0., 'points': 0})
+            totals['count'] += 1
+            totals['duration'] += duration
+            totals['points'] += points
+        self.record({'event': 'stage', 'stage': name, 'duration': duration,
+                'points': points})
+
+    def summary(self):
+        '''Totals by command opcode (with their mean latency) and by
+        stage'''
+        with self.lock:
+            commands = dict((opcode, dict(totals))
+                    for opcode, totals in self.commands.items())
+            stages = dict((name, dict(totals))
+                    for name, totals in self.stages.items())
+        for totals in commands.values():
+            totals['mean_latency'] = totals['latency'] / totals['count']
+        return {'commands': commands, 'stages': stages}
+
+    def close(self):
+        '''Writes the summary to the log file and closes it'''
+        if self.log_file is not None:
+            summary = self.summary()
+            summary['event'] = 'summary'
+            self.record(summary)
+            self.log_file.close()
+            self.log_file = None
+
+class Exchange:
+    '''Counters of the current command of a device, reported to Metrics
+    with each answer: bytes sent and received, busy replies, corrupted
+    frames and commands sent again'''
+    __slots__ = ('opcode', 'start', 'sent', 'received', 'busy',
+            'checksum_errors', 'retries')
+
+    def __init__(self, opcode=None, sent=0):
+        self.opcode = opcode
+        self.start = time.perf_counter()
+        self.sent = sent
+        self.received = 0
+        self.busy = 0
+        self.checksum_errors = 0
+        self.retries = 0
+
+    def next(self):
+        '''Starts counting for the next answer of the same command'''
+        self.__init__(self.opcode)
+
+# delays (s) between requests to a busy device, and used to wait for the end
+# of a corrupted answer
+BUSY_DELAY_MIN = 0.01
+BUSY_DELAY_MAX = 0.5
+DRAIN_TIMEOUT = 0.05
+# bytes of noise skipped looking for a frame before giving up on it
+MAX_SKIPPED = 4096
+
+def check_frame(frame, payload_length):
+    '''Checks the end of a frame read after its length field (payload,
+    checksum and end sequence). Returns the payload, None if the frame is
+    incomplete or False if it is corrupted'''
+    if len(frame) != payload_length+4:
+        return None
+    if frame[-2:] != b'\xB0\xB3':
+        return False
+    payload = frame[:-4]
+    if payload_length == 0 or \
+            struct.unpack_from('>H', frame, payload_length)[0] != \
+            sum(memoryview(payload)) % (2**15):
+        return False
+    return payload
+
+def encode_frame(payload):
+    '''Frames a command payload, returns None if it's too long'''
+    payload = hexlist2bytes(payload)
+    if len(payload) > 0xFFFF:
+        print('Warning: payload is too long, aborting')
+        return None
+    checksum = sum(payload) % (2**15-1)
+    # start sequence, payload length, payload, checksum, end sequence
+    return b''.join((struct.pack('>2sH', b'\xA0\xA2', len(payload)),
+            payload,
+            struct.pack('>H2s', checksum, b'\xB0\xB3')))
+
+class FrameBuffer:
+    '''Incremental parser of the frames sent by the device. The received
+    data is copied (feed) or read (read_from) into a buffer allocated once,
+    and next_frame returns the frames as they are complete, so that frames
+    received together cost one read and their payloads no copy. The
+    unparsed bytes are moved back to the start of the buffer when its end
+    is full, a frame is thus always contiguous'''
+    size = 2**18 # several frames of the largest size (65535 + 8 bytes)
+
+    def __init__(self):
+        self.buffer = bytearray(self.size)
+        self.view = memoryview(self.buffer)
+        self.start = 0 # first byte which isn't parsed yet
+        self.end = 0 # end of the received data
+        self.skipped = 0 # bytes skipped looking for frames, in total
+
+    def __len__(self):
+        return self.end - self.start
+
+    def clear(self):
+        '''Discards the unparsed data'''
+        self.start = self.end = 0
+
+    def space(self):
+        '''Returns the free end of the buffer, to be filled before calling
+        received'''
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.size - self.end < 65543:
+            # room for a whole frame
+            self.buffer[:len(self)] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, len(self)
+        return self.view[self.end:]
+
+    def received(self, size):
+        '''Adds size bytes written at the start of space'''
+        self.end += size
+
+    def feed(self, data):
+        '''Adds received data'''
+        space = self.space()
+        if len(data) > len(space):
+            # not a frame anymore, keep the newest data
+            self.clear()
+            data = data[-self.size:]
+            space = self.view
+        space[:len(data)] = data
+        self.received(len(data))
+
+    def read_from(self, fd):
+        '''Reads what is available on the file descriptor fd into the
+        buffer without copy, returns the number of bytes read'''
+        size = os.readv(fd, [self.space()])
+        self.received(size)
+        return size
+
+    def needed(self):
+        '''Number of bytes still missing to complete the next frame, as far
+        as it's known'''
+        if len(self) < 4 or self.buffer[self.start:self.start + 2] != \
+                b'\xA0\xA2':
+            return max(1, 4 - len(self))
+        length = struct.unpack_from('>H', self.buffer, self.start + 2)[0]
+        return max(1, length + 8 - len(self))
+
+    def next_frame(self):
+        '''Returns the payload of the next frame, None if it isn't
+        complete yet or False if it is corrupted (see check_frame). Bytes
+        before the A0 A2 start sequence are skipped. The payload is a view
+        of the buffer, valid until more data is added'''
+        start = self.buffer.find(b'\xA0\xA2', self.start, self.end)
+        if start < 0:
+            # keep a last A0, which may begin the start sequence
+            start = self.end
+            if self.end and self.buffer[self.end - 1] == 0xA0:
+                start -= 1
+            self.skipped += start - self.start
+            self.start = start
+            return None
+        self.skipped += start - self.start
+        self.start = start
+        if self.end - start < 4:
+            return None
+        payload_length = struct.unpack_from('>H', self.buffer, start + 2)[0]
+        if isDebug:
+            print('longueur : ' + str(payload_length))
+        if self.end - start < payload_length + 8:
+            return None
+        self.start = start + payload_length + 8
+        return check_frame(self.view[start + 4:self.start], payload_length)
+
+def parse_headers(header_list):
+    '''Parses the 12 bytes headers of the 0xBB answers, returns a list of
+    (index, date, time, first_in_session) tuples'''
+    if isDebug:
+        print("header_list: " + bytes(header_list).hex(' '))
+    # time is bytes 0-4, but first byte is used to detect first track
+    return [(index, date, bytes2int(htime), first == 0x80)
+            for first, htime, date, index in struct.iter_unpack('>B3sII',
+                header_list[:len(header_list) // 12 * 12])]
+
+
+# what to do with a frame read while waiting for an answer, see
+# DeviceClient.check_answer
+ANSWER_RECEIVED, READ_AGAIN, WAIT_BUSY, SEND_AGAIN, GIVE_UP = range(5)
+
+class Reception:
+    '''State of the reception of the answer to a command, see
+    DeviceClient.check_answer'''
+    __slots__ = ('resend', 'errors', 'busy_start', 'busy_delay', 'delay')
+
+    def __init__(self, resend=True):
+        self.resend = resend
+        self.errors = 0
+        self.busy_start = None
+        self.busy_delay = BUSY_DELAY_MIN
+        # wait before asking a busy device again
+        self.delay = 0
+
+class DeviceClient:
+    '''What DG200 and AsyncDG200 share, whatever the way the serial port is
+    read: framing of the commands, handling of the answers and cache of the
+    device state. Subclasses provide write, read_frame, drain and the
+    commands'''
+    max_retries = 3 # times a command is sent again after a bad answer
+    busy_timeout = 5 # s, longest wait for a busy device
+
+    def setup(self, timeout, metrics):
+        self.timeout = timeout
+        self.metrics = metrics
+        self.exchange = Exchange()
+        self.frames = FrameBuffer()
+        self.forget_state()
+
+    def send(self,payload):
+        seq = encode_frame(payload)
+        if seq is None:
+            return 0
+        if isDebug:
+            print("Sent: " + seq.hex(' '))
+        # kept to send it again if the answer is lost or corrupted
+        self.last_command = seq
+        self.exchange = Exchange(seq[4], len(seq))
+        bytes_transfered = self.write(seq)
+        return(bytes_transfered)
+
+    def resend(self):
+        '''Sends the last command again'''
+        self.exchange.sent += len(self.last_command)
+        self.write(self.last_command)
+
+    def report(self, ok):
+        '''Reports the current answer to the metrics'''
+        if self.metrics is not None and self.exchange.opcode is not None:
+            self.metrics.command(self.port, self.exchange, ok)
+        self.exchange.next()
+
+    def check_answer(self, payload, reception):
+        '''Tells what to do with payload, what read_frame returned while
+        waiting for the answer to the last command: ANSWER_RECEIVED,
+        READ_AGAIN, WAIT_BUSY (send the command again after reception.delay),
+        SEND_AGAIN (drain and send the command again) or GIVE_UP. Corrupted
+        frames and timeouts make the command be sent again (if
+        reception.resend is true, else it gives up at once), at most
+        max_retries times. Busy (0x12) answers are waited for with an
+        increasing delay, at most busy_timeout seconds'''
+        if payload and payload[0] == 0x12:
+            # Device not ready, the answer will follow
+            if isDebug:
+                print('Device not ready, waiting a bit')
+            self.exchange.busy += 1
+            if reception.busy_start is None:
+                reception.busy_start = time.monotonic()
+            elif time.monotonic() - reception.busy_start > self.busy_timeout:
+                print("Warning: device busy for too long")
+                self.report(False)
+                return GIVE_UP
+            return READ_AGAIN
+        if payload is None and reception.busy_start is not None and \
+                time.monotonic() - reception.busy_start <= self.busy_timeout:
+            # still busy: ask again after a growing delay
+            reception.delay = reception.busy_delay
+            reception.busy_delay = min(2 * reception.busy_delay,
+                    BUSY_DELAY_MAX)
+            return WAIT_BUSY
+        if payload and payload[0] == self.last_command[4]:
+            if isDebug:
+                print("Received: " + payload.hex(' '))
+            self.report(True)
+            return ANSWER_RECEIVED
+        reception.errors += 1
+        if payload:
+            # answer to another command, skip it
+            if reception.errors > self.max_retries:
+                self.report(False)
+                return GIVE_UP
+            return READ_AGAIN
+        # timeout or corrupted frame
+        if payload is False:
+            print("Error in received pattern")
+            self.exchange.checksum_errors += 1
+        if not reception.resend or reception.errors > self.max_retries:
+            self.report(False)
+            return GIVE_UP
+        self.exchange.retries += 1
+        return SEND_AGAIN
+
+    def forget_state(self):
+        '''Empties the cache of the device state: the configuration is read
+        again from the device'''
+        # last configuration read or written, stale once written
+        self.configuration = None
+        self.configuration_stale = True
+
+    def configuration_received(self, conf):
+        '''Keeps the configuration read from the device, conf being the
+        answer to 0xB7 (None if it didn't come). Returns conf'''
+        self.conf = conf
+        if conf:
+            self.configuration = Configuration.decode(conf)
+            self.configuration_stale = False
+        return conf
+
+    def configuration_to_send(self, settings):
+        '''Returns the Configuration of a Configuration or a configuration
+        dictionary (see decode_configuration), None if it's the
+        configuration the device is known to have'''
+        if not isinstance(settings, Configuration):
+            settings = dict(settings)
+            settings.pop('memory_usage', None)
+            settings = Configuration(**settings)
+        if settings == self.configuration:
+            return None
+        return settings
+
+    def configuration_sent(self, settings, answer):
+        '''Keeps the Configuration settings sent to the device, answer being
+        the answer of the device. Returns True on success'''
+        if answer is None:
+            # the device may have the new configuration or not
+            self.configuration = None
+            self.configuration_stale = True
+            return None
+        memory_usage = self.configuration and self.configuration.memory_usage
+        self.configuration = Configuration(memory_usage,
+                **{key: getattr(settings, key) for key in CONFIGURATION_TYPES})
+        # read it again when asked for
+        self.configuration_stale = True
+        return True
+
+    def memory_cleared(self, answer):
+        '''Returns True if answer, the answer to 0xBA, reports a successful
+        memory clear'''
+        # the memory usage has changed
+        self.configuration_stale = True
+        return answer is not None and bytes2int(answer[1:5]) == 0
+
+class DG200(DeviceClient, Serial):
     '''DG200 Class with appropriate methods for sending and receiving data from
     it'''
-    def __init__(self):
+    def __init__(self, timeout=1, metrics=None):
         Serial.__init__(self)
         self.baudrate = 230400
-        self.timeout = 1
+        self.setup(timeout, metrics)
 
     def connect(self,tty_USB):
         try:
@@ -152,90 +2763,389 @@ class DG200(Serial):
             print("Warning: can't connect to " + tty_USB)
             return 0
 
-    def send(self,payload):
-        sequence = ['0xA0', '0xA2'] # start sequence
-        if len(payload) <= int('ffff',16):
-            # payload length (2 bytes)
-            sequence.append("0x" + "{0:0>4X}".format(len(payload))[0:2]) 
-            sequence.append("0x" + "{0:0>4X}".format(len(payload))[2:4])
-        else:
-            print('Warning: payload is too long, aborting')
-            return 0
-        sequence.extend(payload) # payload sequence
-        checksum = 0 # calculating checksum
-        for x in payload:
-            checksum = checksum + int(x,16)
-        checksum = checksum % (2**15-1)
-        # append checksum (2 bytes)
-        sequence.append("0x" + "{0:0>4X}".format(checksum)[0:2])
-        sequence.append("0x" + "{0:0>4X}".format(checksum)[2:4])
-        sequence.extend(['0xB0', '0xB3']) # end sequence
+    def readinto(self, buffer):
+        '''Reads at most len(buffer) bytes into buffer, waiting for them at
+        most timeout, and returns their number. On POSIX, they are read
+        directly into buffer: Serial.readinto reads them into a new bytes
+        object and copies it'''
+        if os.name != 'posix':
+            return Serial.readinto(self, buffer)
+        if not self.is_open:
+            raise SerialException('port not open')
+        received = 0
+        deadline = time.monotonic() + self.timeout
+        while received < len(buffer):
+            remaining = deadline - time.monotonic()
+            if remaining < 0 or \
+                    not select.select([self.fd], [], [], remaining)[0]:
+                break
+            try:
+                size = os.readv(self.fd, [buffer[received:]])
+            except (BlockingIOError, InterruptedError):
+                continue
+            if not size:
+                raise SerialException('device reports readiness to read but '
+                        'returned no data (device disconnected?)')
+            received += size
+        return received
 
-        if isDebug:
-            print("Sent: " + str(sequence))
-        seq = bytes.fromhex(''.join(sequence).replace('0x',''))
-        bytes_transfered = self.write(seq)
-        return(bytes_transfered)
+    def fill(self):
+        '''Reads into the frame buffer all that the device sent, and at
+        least the bytes missing to the next frame, waiting for them at most
+        timeout. Returns False if they didn't come in time'''
+        size = min(max(self.frames.needed(), self.in_waiting),
+                len(self.frames.space()))
+        received = self.readinto(self.frames.space()[:size])
+        self.frames.received(received)
+        self.exchange.received += received
+        return received == size
 
-    def receive(self):
-        payload = ['0x12']
-        check = 0
-        while payload[0] == '0x12' or check == 1:
-            header = self.read(4)
-            if len(header) != 4:
-                print(header)
+    def read_frame(self):
+        '''Reads the next frame, looking for the A0 A2 start sequence to
+        resynchronise. Returns its payload, None if nothing came before the
+        timeout or False if the frame is corrupted, or if it isn't complete
+        after about timeout or MAX_SKIPPED bytes of noise'''
+        deadline = time.monotonic() + self.timeout
+        skipped = self.frames.skipped
+        while True:
+            payload = self.frames.next_frame()
+            if payload is not None:
+                return payload
+            if self.frames.skipped - skipped > MAX_SKIPPED or \
+                    time.monotonic() > deadline:
+                return False
+            if not self.fill():
                 return None
-            payload_length = header[2]*256+header[3]
-            if isDebug:
-                print('longueur : ' + str(payload_length))
-            payload_raw = self.read(payload_length+4)
-            payload = ['0x' + '{0:0>2X}'.format(x) for x in payload_raw]
-            #payload = [hex(ord(x)) for x in payload_raw]
-            if payload[0] == '0x12': 
-                # then it's a mistake, we should wait before trying again
-                if isDebug:
-                    print('Device not ready, waiting a bit')
-                time.sleep(0.1)
-            # check checksum
-            checksum = 0
-            for x in payload[:-4]:
-                checksum = checksum + int(x,16)
-            checksum = checksum % (2**15)
-            if int(''.join(payload[-4:-2]).replace('0x',''),16) != checksum:
-                print("Error in received pattern")
-                check = 1
-            else:
-                check = 0
-        payload.pop()
-        payload.pop()
-        payload.pop()
-        payload.pop()
-        if isDebug:
-            print("Received: " + str(payload))
-        return(payload)
+
+    def drain(self):
+        '''Discards what the device is still sending, for timeout at
+        most'''
+        self.frames.clear()
+        deadline = time.monotonic() + self.timeout
+        timeout = self.timeout
+        self.timeout = DRAIN_TIMEOUT
+        try:
+            data = self.read(4096)
+            while data and time.monotonic() < deadline:
+                self.exchange.received += len(data)
+                data = self.read(4096)
+        finally:
+            self.timeout = timeout
+
+    def receive(self, resend=True):
+        '''Receives the answer of the last command, see check_answer.
+        Returns None if it can't be received'''
+        reception = Reception(resend)
+        while True:
+            payload = self.read_frame()
+            action = self.check_answer(payload, reception)
+            if action == ANSWER_RECEIVED:
+                # the answer outlives the frame buffer
+                return(bytes(payload))
+            if action == GIVE_UP:
+                return None
+            if action == WAIT_BUSY:
+                time.sleep(reception.delay)
+                self.resend()
+            elif action == SEND_AGAIN:
+                self.drain()
+                self.resend()
 
     def get_configuration(self):
         try:
-            self.send(['0xB7'])
-            self.conf = self.receive()
-            return self.conf
+            self.send(b'\xB7')
+            return self.configuration_received(self.receive())
         except:
             print("Can't get device configuration")
             return 0
 
+    def read_configuration(self, refresh=False):
+        '''Returns the Configuration of the device, None if it can't be
+        read. It is only read from the device the first time, after a
+        configuration change or a memory clear, or with refresh'''
+        if refresh or self.configuration_stale:
+            if not self.get_configuration():
+                return None
+        return self.configuration
+
     def get_id(self):
         try:
-            self.send(['0xBF'])
+            self.send(b'\xBF')
             self.id = self.receive()
             return self.id
         except:
             print("Can't get device ID")
             return 0
 
+    def get_name(self):
+        '''Name of the device for folders: its ID, or its port if the ID
+        can't be read'''
+        device_id = self.get_id()
+        if device_id:
+            return bytes(device_id[1:]).hex()
+        return os.path.basename(self.port)
+
+    def set_configuration(self, settings):
+        '''Applies a Configuration or a configuration dictionary (see
+        decode_configuration). Nothing is sent if it's the configuration
+        the device is known to have. Returns True on success'''
+        settings = self.configuration_to_send(settings)
+        if settings is None:
+            return True
+        self.send(settings.encode())
+        return self.configuration_sent(settings, self.receive())
+
+    def header_pages(self):
+        '''Reads the headers of the track parts one 0xBB answer at a time,
+        yields the list of (index, date, time, first_in_session) tuples of
+        each answer'''
+        next_index = b'\x00\x00' # get first header command
+        while True:
+            self.send(b'\xBB' + next_index)
+            answer = self.receive()
+            if answer is None:
+                raise IOError("Can't read the track headers")
+            # Remove the first bytes (number of headers)
+            yield parse_headers(answer[5:])
+            next_index = bytes(answer[3:5]) # Index of next track header
+            if bytes2int(next_index) == 0:
+                # if it's zero, then there is no more header iteration
+                break
+
+    def get_headers(self):
+        '''Reads the headers of all the track parts, returns a list of
+        (index, date, time, first_in_session) tuples'''
+        return [header for page in self.header_pages() for header in page]
+
+    def get_track_part(self, index, progress=None):
+        '''Downloads one track part, returns its payload (both halves of the
+        answer without their command bytes), None if it can't be received.
+        progress is called with 2 once both halves are received'''
+        for attempt in range(self.max_retries + 1):
+            # get track command with the index of the track component
+            self.send(struct.pack('>BH', 0xB5, index))
+            self.exchange.retries = attempt
+            # the command is sent again for both halves
+            first_part = self.receive(resend=False)
+            second_part = first_part and self.receive(resend=False)
+            if second_part:
+                if progress:
+                    progress(2)
+                # remove command bytes
+                return first_part[1:] + second_part[1:]
+            self.drain()
+        print("Warning: can't get track part " + str(index))
+        return None
+
+    def clear_memory(self):
+        '''Erases all the tracks, returns True on success'''
+        self.send(b'\xBA\xFF\xFF')
+        return self.memory_cleared(self.receive())
+
+class AsyncDG200(DeviceClient):
+    '''asyncio version of DG200. The serial port is non-blocking and read
+    through the event loop (POSIX only), so that many devices can be driven
+    from one loop without threads. Commands are serialized by a lock, so
+    that concurrent coroutines don't mix their answers'''
+    def __init__(self, timeout=1, metrics=None):
+        self.serial = Serial()
+        self.serial.baudrate = 230400
+        self.serial.timeout = 0
+        self.setup(timeout, metrics)
+        # set when data is added to the frame buffer
+        self.data_event = None
+        self.error = None
+        self.lock = None
+
+    async def connect(self,tty_USB):
+        try:
+            self.serial.port = tty_USB
+            self.serial.open()
+        except:
+            print("Warning: can't connect to " + tty_USB)
+            return 0
+        loop = asyncio.get_running_loop()
+        self.data_event = asyncio.Event()
+        self.lock = asyncio.Lock()
+        loop.add_reader(self.serial.fileno(), self.data_received)
+        if isDebug:
+            print('Connection to ' + tty_USB + ' successful!')
+        return 1
+
+    def data_received(self):
+        try:
+            size = self.frames.read_from(self.serial.fileno())
+        except BlockingIOError:
+            return
+        except OSError as error:
+            asyncio.get_running_loop().remove_reader(self.serial.fileno())
+            self.error = error
+            self.data_event.set()
+            return
+        self.exchange.received += size
+        self.data_event.set()
+
+    def close(self):
+        if self.serial.is_open:
+            asyncio.get_running_loop().remove_reader(self.serial.fileno())
+            self.serial.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    @property
+    def port(self):
+        return self.serial.port
+
+    def write(self, data):
+        return self.serial.write(data)
+
+    async def wait_data(self, timeout=None):
+        '''Waits for data to be added to the frame buffer, returns False
+        if none came before the timeout'''
+        self.data_event.clear()
+        try:
+            await asyncio.wait_for(self.data_event.wait(),
+                    timeout or self.timeout)
+        except asyncio.TimeoutError:
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+    async def read_frame(self):
+        '''Reads the next frame, see DG200.read_frame. The frame buffer is
+        filled by data_received as the data comes'''
+        deadline = time.monotonic() + self.timeout
+        skipped = self.frames.skipped
+        while True:
+            payload = self.frames.next_frame()
+            if payload is not None:
+                return payload
+            remaining = deadline - time.monotonic()
+            if self.frames.skipped - skipped > MAX_SKIPPED or remaining <= 0:
+                return False
+            if not await self.wait_data(remaining):
+                return None
+
+    async def drain(self):
+        '''Discards what the device is still sending, for timeout at
+        most'''
+        self.frames.clear()
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline and \
+                await self.wait_data(DRAIN_TIMEOUT):
+            self.frames.clear()
+
+    async def receive(self, resend=True):
+        '''Receives the answer of the last command, see DG200.receive'''
+        reception = Reception(resend)
+        while True:
+            payload = await self.read_frame()
+            action = self.check_answer(payload, reception)
+            if action == ANSWER_RECEIVED:
+                return bytes(payload)
+            if action == GIVE_UP:
+                return None
+            if action == WAIT_BUSY:
+                await asyncio.sleep(reception.delay)
+                self.resend()
+            elif action == SEND_AGAIN:
+                await self.drain()
+                self.resend()
+
+    async def command(self,payload):
+        '''Sends a command and returns its answer'''
+        async with self.lock:
+            self.send(payload)
+            return await self.receive()
+
+    async def get_configuration(self):
+        return self.configuration_received(await self.command(b'\xB7'))
+
+    async def read_configuration(self, refresh=False):
+        '''Returns the Configuration of the device, see
+        DG200.read_configuration'''
+        if refresh or self.configuration_stale:
+            if not await self.get_configuration():
+                return None
+        return self.configuration
+
+    async def get_id(self):
+        self.id = await self.command(b'\xBF')
+        return self.id
+
+    async def set_configuration(self, settings):
+        '''Applies a Configuration or a configuration dictionary, see
+        DG200.set_configuration'''
+        settings = self.configuration_to_send(settings)
+        if settings is None:
+            return True
+        return self.configuration_sent(settings,
+                await self.command(settings.encode()))
+
+    async def header_pages(self):
+        '''Asynchronous iterator over the header pages, see
+        DG200.header_pages'''
+        next_index = b'\x00\x00'
+        while True:
+            answer = await self.command(b'\xBB' + next_index)
+            if answer is None:
+                raise IOError("Can't read the track headers")
+            yield parse_headers(answer[5:])
+            next_index = bytes(answer[3:5])
+            if bytes2int(next_index) == 0:
+                break
+
+    async def get_headers(self):
+        '''Reads the headers of all the track parts, see DG200.get_headers'''
+        return [header async for page in self.header_pages()
+                for header in page]
+
+    async def list_tracks(self):
+        '''Returns the tracks as lists of headers (see group_sessions)'''
+        return group_sessions(await self.get_headers())
+
+    async def get_track_part(self, index):
+        '''Downloads one track part, see DG200.get_track_part'''
+        async with self.lock:
+            for attempt in range(self.max_retries + 1):
+                self.send(struct.pack('>BH', 0xB5, index))
+                self.exchange.retries = attempt
+                # the command is sent again for both halves
+                first_part = await self.receive(resend=False)
+                second_part = first_part and await self.receive(resend=False)
+                if second_part:
+                    return first_part[1:] + second_part[1:]
+                await self.drain()
+        print("Warning: can't get track part " + str(index))
+        return None
+
+    async def track_parts(self, list_index):
+        '''Asynchronous iterator over the (index, payload) of track parts'''
+        for index in list_index:
+            yield index, await self.get_track_part(index)
+
+    async def points(self, list_index):
+        '''Asynchronous iterator over the points of track parts'''
+        async for index, track_raw in self.track_parts(list_index):
+            if track_raw is None:
+                raise IOError("Can't download track part " + str(index))
+            for point in process_track_part(memoryview(track_raw)):
+                yield point
+
+    async def clear_memory(self):
+        '''Erases all the tracks, returns True on success'''
+        return self.memory_cleared(await self.command(b'\xBA\xFF\xFF'))
+
 class main:
 
     def __init__(self):
         '''User interface of the DG200 datalogger control software'''
+        import_gtk()
         self.builder = Gtk.Builder()
         self.builder.add_from_file("Gui.ui") 
         self.window = self.builder.get_object("window_main")
@@ -272,6 +3182,12 @@ class main:
                 self.builder.get_object("button_select_none")
         self.button_download= \
                 self.builder.get_object("button_download")
+        self.button_cancel= \
+                self.builder.get_object("button_cancel")
+        self.button_sync= \
+                self.builder.get_object("button_sync")
+        self.button_download_all= \
+                self.builder.get_object("button_download_all")
         self.button_clear_mem= \
                 self.builder.get_object("button_clear_mem")
         self.button_get_conf= \
@@ -317,10 +3233,15 @@ class main:
                 "on_button_apply_conf_clicked": self.set_configuration,
                 "on_button_get_track_list_clicked": self.get_track_list,
                 "on_button_download_clicked": self.download_tracks,
+                "on_button_cancel_clicked": self.cancel_download,
+                "on_button_sync_clicked": self.sync_tracks,
+                "on_button_download_all_clicked": self.download_all_devices,
                 "on_button_select_all_clicked": self.select_all,
                 "on_button_select_none_clicked": self.select_none,
                }
         self.builder.connect_signals(dict)
+        self.list_ttyUSB = []
+        self.export_format = 'gpx'
 
     def toggled_cb(self,cell, path, user_data):
         model, column = user_data
@@ -337,43 +3258,44 @@ class main:
     def select_none(self, widget):
         for row in self.treestore:
             row[0] = False
+
+    def select_new(self, widget):
+        '''Selects the tracks having parts which are not in the cache'''
+        for session, row in enumerate(self.treestore):
+            row[0] = self.headers.is_new(session, self.cache)
+
+    def sync_tracks(self, widget):
+        '''Downloads only the tracks with parts new since the last run'''
+        self.select_new(widget)
+        self.download_tracks(widget)
          
-    def set_sensitive(self):
-        self.button_get_track_list.set_sensitive(True)
-        self.button_select_all.set_sensitive(True)
-        self.button_select_none.set_sensitive(True)
-        self.button_download.set_sensitive(True)
-        self.button_clear_mem.set_sensitive(True)
-        self.radiobutton_ptds.set_sensitive(True)
-        self.radiobutton_ptdsa.set_sensitive(True)
-        self.radiobutton_by_time.set_sensitive(True)
-        self.radiobutton_by_distance.set_sensitive(True)
-        self.checkbutton_waas.set_sensitive(True)
-        self.checkbutton_disable_speed.set_sensitive(True)
-        self.checkbutton_disable_distance.set_sensitive(True)
-        self.entry_time_interval.set_sensitive(True)
-        self.entry_distance_interval.set_sensitive(True)
-        self.entry_speed_threshold.set_sensitive(True)
-        self.entry_distance_threshold.set_sensitive(True)
-        self.button_get_conf.set_sensitive(True)
-        self.button_apply_conf.set_sensitive(True)
+    def set_sensitive(self,sensitive=True):
+        self.button_get_track_list.set_sensitive(sensitive)
+        self.button_select_all.set_sensitive(sensitive)
+        self.button_select_none.set_sensitive(sensitive)
+        self.button_download.set_sensitive(sensitive)
+        self.button_sync.set_sensitive(sensitive)
+        self.button_download_all.set_sensitive(sensitive)
+        self.button_clear_mem.set_sensitive(sensitive)
+        self.radiobutton_ptds.set_sensitive(sensitive)
+        self.radiobutton_ptdsa.set_sensitive(sensitive)
+        self.radiobutton_by_time.set_sensitive(sensitive)
+        self.radiobutton_by_distance.set_sensitive(sensitive)
+        self.checkbutton_waas.set_sensitive(sensitive)
+        self.checkbutton_disable_speed.set_sensitive(sensitive)
+        self.checkbutton_disable_distance.set_sensitive(sensitive)
+        self.entry_time_interval.set_sensitive(sensitive)
+        self.entry_distance_interval.set_sensitive(sensitive)
+        self.entry_speed_threshold.set_sensitive(sensitive)
+        self.entry_distance_threshold.set_sensitive(sensitive)
+        self.button_get_conf.set_sensitive(sensitive)
+        self.button_apply_conf.set_sensitive(sensitive)
 
     def detect(self,widget):
         '''Tries to detect the presence of DG200'''
         if isDebug:
             print("Detects the DG200")
-        self.list_ttyUSB = []
-        for x in range(0,10):
-            if os.path.exists('/dev/ttyUSB' + str(x)):
-                try:
-                    test = DG200()
-                    test.connect('/dev/ttyUSB' + str(x)) 
-                    if test.get_id() != 0:
-                        self.list_ttyUSB.append('/dev/ttyUSB' + str(x))
-                    test.close()
-                except:
-                    test.close()
-                    pass
+        self.list_ttyUSB = detect_devices()
         self.entry_detect.set_text(self.list_ttyUSB[0])
         if isDebug:
             print("DG200 detected on " + str(self.list_ttyUSB))
@@ -385,6 +3307,11 @@ class main:
         self.dg200 = DG200()
         res = self.dg200.connect(self.entry_detect.get_text())
         if res == 1:
+            self.cache = TrackCache(device=self.dg200.get_name())
+            # no track listed yet for this device
+            self.treestore.clear()
+            self.headers = HeaderTable()
+            self.header_keys = {}
             self.set_sensitive()
             self.get_configuration(None)
 
@@ -392,173 +3319,107 @@ class main:
         '''Get the configuration of th device'''
         if isDebug:
             print('Get configuration')
-        #try:
-        self.dg200.get_configuration()
-        if self.dg200.conf != 0:
+        # the button reads it again, otherwise the known one is enough
+        conf = self.dg200.read_configuration(refresh=widget is not None)
+        if conf:
             # Information type
-            if bytes2int(self.dg200.conf[1]) == 1:
+            if conf.format == 1:
                 self.radiobutton_ptds.set_active(1)
-            elif bytes2int(self.dg200.conf[1]) == 2:
+            elif conf.format == 2:
                 self.radiobutton_ptdsa.set_active(1)
             # Interval by time or distance
-            if bytes2int(self.dg200.conf[26]) == 0:
-                self.radiobutton_by_time.set_active(True)
-            else:
+            if conf.by_distance:
                 self.radiobutton_by_distance.set_active(True)
+            else:
+                self.radiobutton_by_time.set_active(True)
             # Time interval
-            self.entry_time_interval.set_text(
-                    str(bytes2int(self.dg200.conf[12:16])/1000))
+            self.entry_time_interval.set_text(str(conf.time_interval))
             # Distance interval
             self.entry_distance_interval.set_text(
-                    str(bytes2int(self.dg200.conf[29:33])))
+                    str(conf.distance_interval))
             # Speed threshold flag
-            if bytes2int(self.dg200.conf[2]) == 1:
-                self.checkbutton_disable_speed.set_active(True)
+            self.checkbutton_disable_speed.set_active(conf.disable_speed)
             # Speed threshold
-            self.entry_speed_threshold.set_text(
-                    str(bytes2int(self.dg200.conf[3:7])))
+            self.entry_speed_threshold.set_text(str(conf.speed_threshold))
             # Distance threshold flag
-            if bytes2int(self.dg200.conf[7]) == 1:
-                self.checkbutton_disable_distance.set_active(True)
+            self.checkbutton_disable_distance.set_active(
+                    conf.disable_distance)
             # Distance threshold
             self.entry_distance_threshold.set_text(
-                    str(bytes2int(self.dg200.conf[8:12])))
+                    str(conf.distance_threshold))
             # WAAS flag
-            if bytes2int(self.dg200.conf[42]) == 1:
-                self.checkbutton_waas.set_active(True)
+            self.checkbutton_waas.set_active(conf.waas)
             self.label_memory_usage.set_text(
-                    'Memory usage: ' + str(bytes2int(self.dg200.conf[43])) + '%')
+                    'Memory usage: ' + str(conf.memory_usage) + '%')
 
     def set_configuration(self,widget):
         '''Apply new configuration from the GUI to the device'''
         print('Set configuration')
-        payload = ['0xB8']
-        # Information type
-        if self.radiobutton_ptdsa.get_active():
-            payload.append('0x02')
-        else:
-            payload.append('0x01')
-        # Speed threshold flag
-        if self.checkbutton_disable_speed.get_active():
-            payload.append('0x01')
-        else:
-            payload.append('0x00')
-        # Speed threshold
-        try:
-            speed_threshold = \
-                    int2bytes(int(self.entry_speed_threshold.get_text()),4)
-        except:
-            speed_threshold = ['0x00', '0x00', '0x00', '0x00']
-        payload.extend(speed_threshold)
-        # Distance threshold flag
-        if self.checkbutton_disable_distance.get_active():
-            payload.append('0x01')
-        else:
-            payload.append('0x00')
-        #Distance threshold
-        try:
-            distance_threshold = \
-                    int2bytes(int(self.entry_distance_threshold.get_text()),4)
-        except:
-            distance_threshold = ['0x00', '0x00', '0x00', '0x00']
-        payload.extend(distance_threshold)
-        # Time interval
-        try:
-            time_interval = \
-                    int2bytes(1000 * int(self.entry_time_interval.get_text()),4)
-        except:
-            time_interval = ['0x00', '0x00', '0x00', '0x00']
-        payload.extend(time_interval)
-        # Lot of unused bytes
-        payload.extend(
-                ['0x00','0x00','0x00','0x00','0x00','0x00','0x00','0x00','0x00','0x00'])
-        # Interval by time/distance flag
-        if self.radiobutton_by_time.get_active():
-            payload.append('0x00')
-        else:
-            payload.append('0x01')
-        # Lot of unused bytes
-        payload.extend(['0x00','0x00'])
-        # Interval by distance
+        settings = {
+            # Information type
+            'format': 2 if self.radiobutton_ptdsa.get_active() else 1,
+            'disable_speed': self.checkbutton_disable_speed.get_active(),
+            'disable_distance': self.checkbutton_disable_distance.get_active(),
+            'by_distance': not self.radiobutton_by_time.get_active(),
+            'waas': self.checkbutton_waas.get_active(),
+            }
+        for key, entry in (('speed_threshold', self.entry_speed_threshold),
+                ('distance_threshold', self.entry_distance_threshold),
+                ('time_interval', self.entry_time_interval),
+                ('distance_interval', self.entry_distance_interval)):
+            try:
+                settings[key] = CONFIGURATION_TYPES[key](float(entry.get_text()))
+            except ValueError:
+                settings[key] = 0
         try:
-            distance_interval = \
-                    int2bytes(int(self.entry_distance_interval.get_text()),4)
-        except:
-            distance_interval = ['0x00', '0x00', '0x00', '0x00']
-        payload.extend(distance_interval)
-        # Lot of unused bytes
-        payload.extend(['0x00','0x00','0x00','0x00','0x00','0x00','0x00','0x00'])
-        # Operation mode should be 4
-        payload.append('0x04')
-        # WAAS
-        if self.checkbutton_waas.get_active():
-            payload.append('0x01')
-        else:
-            payload.append('0x00')
+            settings = Configuration(**settings)
+        except ValueError as error:
+            print('Warning: ' + str(error))
+            return
         # Send command and check if everything is correct
-        self.dg200.send(payload)
-        test = self.dg200.receive()
+        test = self.dg200.set_configuration(settings)
 
     def get_track_list(self,widget):
         '''get track list from the header files'''
         if isDebug:
             print("Get track list")
         self.treestore.clear()
-        self.dg200.send(['0xBB', '0x00', '0x00']) # get first header command
-        header_list_tmp = self.dg200.receive()
-        header_list = header_list_tmp[5:] # Remove the first bytes (number of headers)
-        self.header_index = []
-        header_iter = None
-        header_track_num = 0 # number of track components in one track
-        next_tracker_index = bytes2int(header_list_tmp[3:5]) # Index of next track header
-        while next_tracker_index != 0: 
-            # if it's zero, then there is no more header iteration
-            # Get next header file
-            self.dg200.send(['0xBB', header_list_tmp[3], header_list_tmp[4]])
-            header_list_tmp = self.dg200.receive()
-            next_tracker_index = bytes2int(header_list_tmp[3:5]) 
-            header_list.extend(header_list_tmp[5:]) # Whole track list is built
-
-        if isDebug:
-            print("header_list: " + str(header_list))
-        # Now we process this header_list
-        nb_header = round(len(header_list)/12)
-        for num_header in range(0,nb_header):
-            header_date_raw = '{0:0>6d}'.format(
-                    bytes2int(header_list[4+12*num_header:8+12*num_header]))
-            header_date = '/'.join([
-                    header_date_raw[0:2],
-                    header_date_raw[2:4],
-                    header_date_raw[4:6]])
-            # time is bytes 0-4, but first byte is used to detect first track
-            header_time_raw = '{0:0>6d}'.format(
-                    bytes2int(header_list[1+12*num_header:4+12*num_header]))
-            header_time = ':'.join([
-                    header_time_raw[0:2],
-                    header_time_raw[2:4],
-                    header_time_raw[4:6]])
-            # We want to keep the header_index, thus the self
-            self.header_index.append(bytes2int(header_list[8 + 12*num_header : 12 +
-                    12*num_header]))
-            if header_list[12*num_header] == '0x80':
-                # header is first in its session
-                if header_iter: 
-                    # set number of track components of the previous header
-                    self.treestore.set_value(header_iter, 4, header_track_num)
-                    header_track_num = 0
+        # the rows are the sessions of the header table, in the same order
+        self.headers = HeaderTable()
+        self.header_keys = {}
+        # the headers are read in the background, the tracks are listed
+        # page by page as they come
+        self.start_download(self.list_worker, None)
 
-                header_iter = self.treestore.append(
-                        None,[True,header_date,header_time,self.header_index[num_header],0])
-            # increase track components number
-            header_track_num += 1
+    def list_worker(self,argument):
+        '''Reads the header pages, run in a separate thread'''
+        try:
+            for page in self.dg200.header_pages():
+                GLib.idle_add(self.add_headers, page)
+                if self.cancel_event.is_set():
+                    break
+        finally:
+            GLib.idle_add(self.download_finished)
 
-            if num_header == nb_header - 1: # close things at the end
-                self.treestore.set_value(header_iter, 4, header_track_num)
+    def add_headers(self,page):
+        '''Adds a page of headers to the track list, in the GUI thread'''
+        # the last header had no key, it isn't the last one any more
+        start = max(len(self.headers.headers) - 1, 0)
+        for session in self.headers.extend(page):
+            index, date, htime, first = self.headers.first(session)
+            if session < len(self.treestore):
+                # the last track got more parts
+                self.treestore[session][4] = self.headers.size(session)
+            else:
+                self.treestore.append(None, [True, format_header_date(date),
+                        format_header_time(htime), index,
+                        self.headers.size(session)])
+        self.header_keys.update(self.headers.keys(start))
+        self.progress_bar.pulse()
+        return False
 
-    def download_tracks(self,widget):
-        '''Find which tracks to download and launch the downloader'''
-        if isDebug:
-            print("download files")
+    def choose_folder(self):
+        '''Asks for the download folder, returns None if cancelled'''
         # open dialog for setting the download folder
         open_dialog = Gtk.FileChooserDialog(title=None, parent=self.window,
                 action=Gtk.FileChooserAction.SELECT_FOLDER,
@@ -566,83 +3427,134 @@ class main:
         open_dialog.set_current_folder(os.path.expanduser("~"))
         open_dialog.set_show_hidden(False)
         open_dialog.set_title("Choose download directory")
+        # format of the downloaded files
+        combo_format = Gtk.ComboBoxText()
+        for export_format in EXPORTERS:
+            combo_format.append(export_format, export_format.upper())
+        combo_format.append('gpx-merged', 'GPX, all tracks in one file')
+        combo_format.set_active_id(self.export_format)
+        open_dialog.set_extra_widget(combo_format)
         res = open_dialog.run()
+        folder = open_dialog.get_filename()
+        export_format = combo_format.get_active_id()
+        open_dialog.destroy()
         if res == Gtk.ResponseType.OK: # OK button clicked
+            self.export_format = export_format or 'gpx'
+            return folder
+        return None
+
+    def download_tracks(self,widget):
+        '''Find which tracks to download and launch the downloader'''
+        if isDebug:
+            print("download files")
+        self.folder = self.choose_folder()
+        if self.folder is not None:
             self.nbtrackparts = 0
             self.progress_counter = 0
-            self.folder = open_dialog.get_filename()
-            open_dialog.destroy()
-            # calculate the number of track parts to download
-            for row in self.treestore: # for each track
-                if row[0]: # if selected
-                    self.nbtrackparts = self.nbtrackparts + row[4] 
-            # download tracks
-            for row in self.treestore: # for each track
+            # find the indices of the components of the selected tracks
+            tracks = []
+            for session, row in enumerate(self.treestore): # for each track
                 if row[0]: # if selected
-                    # Gets the indices of its components
-                    first_index = self.header_index.index(row[3])
+                    self.nbtrackparts = self.nbtrackparts + row[4]
+                    list_index = self.headers.indices(session)
                     if isDebug:
                         print('date: ' + row[1] + ' ' + row[2] +  \
-                                ", track components: " + \
-                                str(self.header_index[first_index:first_index + row[4]]))
-                    # Go get the track
-                    self.get_track(self.header_index[first_index:first_index + row[4]])
-            # Finished, set progressbar to 0
-            self.progress_bar.set_fraction(float(0))
-            # and get configuration for the diode to switch on
+                                ", track components: " + str(list_index))
+                    tracks.append(list_index)
+            # download tracks in the background, the GUI is only updated
+            # through GLib.idle_add
+            self.start_download(self.download_worker, tracks)
+
+    def download_all_devices(self,widget):
+        '''Downloads the new tracks of all the detected devices at once, in
+        one subfolder per device'''
+        if self.export_format == 'gpx-merged':
+            # as with the --all-devices option
+            print("Warning: the tracks of several devices can't be merged")
+            return
+        self.folder = self.choose_folder()
+        if self.folder is not None:
+            # the devices are opened again by their own download thread
+            self.dg200.close()
+            self.start_download(self.download_all_worker,
+                    self.list_ttyUSB or [self.dg200.port])
+
+    def start_download(self,worker,argument):
+        self.set_sensitive(False)
+        self.button_cancel.set_sensitive(True)
+        self.cancel_event = threading.Event()
+        self.download_thread = threading.Thread(
+                target=worker, args=(argument,), daemon=True)
+        self.download_thread.start()
+
+    def download_all_worker(self,ports):
+        '''Downloads from all the devices, run in a separate thread'''
+        try:
+            download_devices(ports, self.folder, new=True,
+                    progress=DownloadProgress(self.devices_progress),
+                    cancel=self.cancel_event,
+                    export_format=self.export_format)
+        finally:
+            try:
+                self.dg200.open()
+            except SerialException as error:
+                print("Warning: can't open " + str(self.dg200.port) + ": " +
+                        str(error))
+            GLib.idle_add(self.download_finished)
+
+    def devices_progress(self,received,total):
+        if total:
+            GLib.idle_add(self.update_progress, float(received)/float(total))
+
+    def download_worker(self,tracks):
+        '''Downloads the tracks, run in a separate thread. The tracks are
+        decoded and written by other processes, in parallel'''
+        try:
+            merge = self.export_format == 'gpx-merged'
+            export_format = 'gpx' if merge else self.export_format
+            # the parts received by an interrupted download of the same
+            # tracks to the same folder aren't downloaded again
+            checkpoint = DownloadCheckpoint(self.folder)
+            checkpoint.start(self.dg200.get_name(), self.headers.headers,
+                    tracks, export_format, merge)
+            download_sessions(self.dg200, tracks, self.folder,
+                    self.header_keys, self.cache, self.part_received,
+                    self.cancel_event, export_format, merge=merge,
+                    checkpoint=checkpoint)
+            if not self.cancel_event.is_set():
+                checkpoint.finish()
+            # get configuration for the diode to switch on
             self.dg200.get_configuration()
-            while Gtk.events_pending():
-                Gtk.main_iteration()
-        else:
-            open_dialog.destroy()
+        finally:
+            GLib.idle_add(self.download_finished)
 
-    def get_track(self,list_index):
-        '''Download one track'''
-        track = []
-        for index in list_index:
-            payload = ['0xB5'] # get track command
-            payload.extend(int2bytes(index,2)) # specify index of track component
-            self.dg200.send(payload)
-            first_part = self.dg200.receive()
-            first_part.pop(0) # remove command byte
-            self.progress_counter += 1
-            self.progress_bar.set_fraction(float(self.progress_counter)/float(2*self.nbtrackparts))
-            while Gtk.events_pending():
-                Gtk.main_iteration()
-            second_part = self.dg200.receive()
-            second_part.pop(0)
-            self.progress_counter += 1
-            self.progress_bar.set_fraction(float(self.progress_counter)/float(2*self.nbtrackparts))
-            while Gtk.events_pending():
-                Gtk.main_iteration()
-            track_raw = first_part + second_part
-
-            # processing of the raw data (remove '0xFF' and convert to list)
-            if bytes2int(track_raw[28:32]) == 1:
-                # Then it's a 20bytes coding (pos,date/time,speed)
-                del(track_raw[-16:]) # remove the 16 trailing FFs
-                while track_raw[-20:] == ['0xFF' for x in range(0,20)]:
-                    del(track_raw[-20:])
-
-                # first point (which is in 32 bytes format)
-                track.append(process_point(track_raw[:32]))
-                nb_points = int((len(track_raw) - 32) / 20 + 1)
-                # next points
-                for point in range(1,nb_points):
-                    track.append(process_point(track_raw[32+20*(point-1):32+20*point]))
-
-            elif bytes2int(track_raw[28:32]) == 2:
-                ## Then it's a 32bytes coding (pos,date/time,speed,altitude)
-                while track_raw[-32:] == ['0xFF' for x in range(0,32)]:
-                    del(track_raw[-32:])
-
-                nb_points = int(len(track_raw)/32)
-                for point in range(0,nb_points):
-                    track.append(process_point(track_raw[32*point:32+32*point]))
-        
+    def download_finished(self):
+        '''Called in the GUI thread once the download thread is over'''
+        self.download_thread.join()
+        # Finished, set progressbar to 0
+        self.progress_bar.set_fraction(float(0))
+        self.button_cancel.set_sensitive(False)
+        # the port may not have been opened again, see download_all_worker
+        self.set_sensitive(self.dg200.is_open)
+        return False
+
+    def cancel_download(self,widget):
+        '''Stops the download at the end of the current track part'''
         if isDebug:
-            print("refined track = " + str(track))
-        write_gpx(self.folder, track)
+            print("Cancel download")
+        self.cancel_event.set()
+        self.button_cancel.set_sensitive(False)
+
+    def update_progress(self,fraction):
+        self.progress_bar.set_fraction(fraction)
+        return False
+
+    def part_received(self,halves):
+        '''Progress callback of download_track, called in the download
+        thread'''
+        self.progress_counter += halves
+        GLib.idle_add(self.update_progress,
+                float(self.progress_counter)/float(2*self.nbtrackparts))
 
     def clear_memory(self,widget):
         '''Clears the memory, after asking for confirmation'''
@@ -655,13 +3567,19 @@ class main:
         dialog.add_button(Gtk.STOCK_OK, Gtk.ResponseType.OK)
         response = dialog.run()
         dialog.destroy()
-        if response == Gtk.ResponseType.OK:
-            self.dg200.send(['0xBA', '0xFF', '0xFF'])
-            res = self.dg200.receive()
-            if bytes2int(res[1:5]) == 0: #bug 
-                print("Memory cleared")
-        self.dg200.get_configuration()
-        self.get_track_list(None)
+        cleared = response == Gtk.ResponseType.OK and \
+                self.dg200.clear_memory()
+        if cleared:
+            print("Memory cleared")
+        # the memory usage has changed
+        self.get_configuration(None)
+        if cleared:
+            # the memory is empty, nothing to list
+            self.treestore.clear()
+            self.headers = HeaderTable()
+            self.header_keys = {}
+        else:
+            self.get_track_list(None)
 
     def quit(self,widget):
         try:
@@ -672,7 +3590,341 @@ class main:
 
 
         
+def parse_setting(setting):
+    '''Converts a KEY=VALUE command line setting to a (key, value) pair,
+    the value having its configuration type'''
+    if '=' not in setting:
+        raise ValueError('expected KEY=VALUE, got ' + setting)
+    key, value = setting.split('=', 1)
+    if key not in CONFIGURATION_TYPES:
+        raise ValueError('unknown setting ' + key + ', expected one of: ' +
+                ', '.join(sorted(CONFIGURATION_TYPES)))
+    if CONFIGURATION_TYPES[key] is bool:
+        if value.lower() in ('1', 'yes', 'true', 'on'):
+            return key, True
+        if value.lower() in ('0', 'no', 'false', 'off'):
+            return key, False
+        raise ValueError('invalid boolean for ' + key + ': ' + value)
+    return key, Configuration.check(key, CONFIGURATION_TYPES[key](value))
+
+def parse_time(text):
+    '''Converts a YYYY-MM-DD[THH:MM[:SS]][Z] UTC time of the command line to
+    seconds since 1970'''
+    text = text.rstrip('Z')
+    for time_format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return calendar.timegm(time.strptime(text, time_format))
+        except ValueError:
+            pass
+    raise ValueError('expected YYYY-MM-DD[THH:MM[:SS]], got ' + text)
+
+def add_simplify_arguments(parser):
+    '''Adds the options of simplify_track to a command'''
+    parser.add_argument('--simplify', type=float, metavar='METRES',
+            help='simplify the tracks, with this tolerance')
+    parser.add_argument('--min-interval', type=float, metavar='SECONDS',
+            help='keep at most one point per interval of time')
+    parser.add_argument('--min-distance', type=float, metavar='METRES',
+            help='keep at most one point per distance along the track')
+    parser.add_argument('--min-speed', type=float, metavar='M/S',
+            help='drop the points slower than this speed')
+
+def simplify_options(args):
+    '''simplify_track keyword arguments of the command line, None if the
+    tracks aren't simplified'''
+    options = dict((key, value) for key, value in (
+            ('tolerance', args.simplify),
+            ('min_interval', args.min_interval),
+            ('min_distance', args.min_distance),
+            ('min_speed', args.min_speed)) if value)
+    return options or None
+
+def cli(argv=None):
+    '''Command line interface, usable without GTK. Returns the exit code'''
+    global isDebug
+    parser = argparse.ArgumentParser(prog='Py3DG200',
+            description='Global Sat DG200 manager. Without command, the '
+            'graphical interface is started.')
+    parser.add_argument('-p', '--port',
+            help='serial port of the device (detected if not given)')
+    parser.add_argument('-d', '--debug', action='store_true',
+            help='print the exchanged data')
+    parser.add_argument('--cache', help='track cache folder')
+    parser.add_argument('--metrics', metavar='FILE',
+            help='log the timings of the exchanges and of the download '
+            'stages to FILE, as JSON lines')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+    commands.add_parser('list', help='list the tracks stored on the device')
+    parser_download = commands.add_parser('download',
+            help='download tracks as GPX files')
+    parser_download.add_argument('-o', '--folder', default='.',
+            help='download folder (default: current folder)')
+    parser_download.add_argument('-f', '--format', default='gpx',
+            choices=sorted(EXPORTERS), help='file format (default: gpx)')
+    parser_download.add_argument('-j', '--jobs', type=int, default=1,
+            help='number of processes decoding and writing the tracks while '
+            'the next ones are downloaded (0: one per core, default: 1)')
+    parser_download.add_argument('--merge', action='store_true',
+            help='write all the tracks in one GPX file')
+    parser_download.add_argument('-n', '--new', action='store_true',
+            help='only download tracks with parts new since the last run')
+    parser_download.add_argument('-a', '--all-devices', action='store_true',
+            help='download from all the detected devices at once, in one '
+            'subfolder per device')
+    parser_download.add_argument('-r', '--resume', action='store_true',
+            help='finish the interrupted download to the folder, only '
+            'downloading its missing track parts')
+    add_simplify_arguments(parser_download)
+    parser_download.add_argument('tracks', nargs='*', type=int,
+            help='numbers of the tracks to download, as shown by the list '
+            'command (default: all)')
+    parser_watch = commands.add_parser('watch',
+            help='download the new tracks of the devices as they are '
+            'plugged in, until interrupted')
+    parser_watch.add_argument('-o', '--folder', default='.',
+            help='download folder, with one subfolder per device (default: '
+            'current folder)')
+    parser_watch.add_argument('-f', '--format', default='gpx',
+            choices=sorted(EXPORTERS), help='file format (default: gpx)')
+    parser_watch.add_argument('-i', '--interval', type=float, default=2,
+            help='time between two listings of the serial ports (s, '
+            'default: 2)')
+    parser_watch.add_argument('--clear', action='store_true',
+            help='erase the memory of the devices once all their track '
+            'parts are archived')
+    add_simplify_arguments(parser_watch)
+    parser_dump = commands.add_parser('dump',
+            help='save the raw track parts to a file, to be decoded later')
+    parser_dump.add_argument('file', help='dump file')
+    parser_replay = commands.add_parser('replay',
+            help='write the tracks of a dump file as GPX files, without '
+            'device')
+    parser_replay.add_argument('file', help='dump file')
+    parser_replay.add_argument('-o', '--folder', default='.',
+            help='output folder (default: current folder)')
+    parser_replay.add_argument('-f', '--format', default='gpx',
+            choices=sorted(EXPORTERS), help='file format (default: gpx)')
+    parser_replay.add_argument('-j', '--jobs', type=int, default=1,
+            help='number of processes decoding and writing the tracks '
+            '(0: one per core, default: 1)')
+    parser_replay.add_argument('--merge', action='store_true',
+            help='write all the tracks in one GPX file')
+    add_simplify_arguments(parser_replay)
+    parser_replay.add_argument('tracks', nargs='*', type=int,
+            help='numbers of the tracks to write (default: all)')
+    parser_find = commands.add_parser('find',
+            help='find the tracks written to a folder in a region or a '
+            'time window, without device')
+    parser_find.add_argument('folder', help='folder of the tracks')
+    parser_find.add_argument('--bbox', type=float, nargs=4,
+            metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'),
+            help='bounding box (degrees)')
+    parser_find.add_argument('--start', type=parse_time,
+            help='start of the time window (UTC, YYYY-MM-DD[THH:MM[:SS]])')
+    parser_find.add_argument('--end', type=parse_time,
+            help='end of the time window (UTC, YYYY-MM-DD[THH:MM[:SS]])')
+    parser_find.add_argument('--points', action='store_true',
+            help='print the ranges of the points of the tracks which are in '
+            'the bounding box and the time window')
+    commands.add_parser('get-config', help='print the device configuration')
+    parser_set = commands.add_parser('set-config',
+            help='change the device configuration')
+    parser_set.add_argument('settings', nargs='+', metavar='KEY=VALUE',
+            help='settings to change: ' + ', '.join(sorted(CONFIGURATION_TYPES)))
+    parser_clear = commands.add_parser('clear',
+            help='erase all the tracks of the device')
+    parser_clear.add_argument('--yes', action='store_true',
+            help='confirm the memory erasing')
+    args = parser.parse_args(argv)
+    isDebug = isDebug or args.debug
+
+    if args.command == 'set-config':
+        try:
+            args.settings = dict(parse_setting(setting)
+                    for setting in args.settings)
+        except (TypeError, ValueError) as error:
+            parser_set.error(str(error))
+    if args.command == 'clear' and not args.yes:
+        parser_clear.error('the memory is only erased with --yes')
+    if args.command == 'download' and args.all_devices and args.tracks:
+        parser_download.error("tracks can't be selected with --all-devices")
+    if args.command == 'download' and args.all_devices and args.merge:
+        parser_download.error("--merge can't be used with --all-devices")
+    if args.command == 'download' and args.resume and (args.tracks or
+            args.new):
+        parser_download.error("the tracks of an interrupted download can't "
+                "be selected")
+    if args.command in ('download', 'replay'):
+        if args.merge and args.format != 'gpx':
+            parser.error('only GPX files can be merged')
+        if args.jobs < 0:
+            parser.error('the number of jobs must be positive')
+
+    metrics = Metrics(log=args.metrics) if args.metrics else None
+    try:
+        return run_command(args, metrics)
+    finally:
+        if metrics is not None:
+            metrics.close()
+
+def run_command(args, metrics):
+    '''Runs a command parsed by cli, reporting to metrics'''
+    if args.command == 'replay':
+        with MemoryDump(args.file) as dump:
+            sessions = [session for session in range(len(dump.headers))
+                    if not args.tracks or session + 1 in args.tracks]
+            for filename in dump.export(args.folder, sessions, args.format,
+                    args.jobs or None, args.merge, simplify_options(args)):
+                print(filename)
+        return 0
+
+    if args.command == 'find':
+        bbox = args.bbox or (-90, -180, 90, 180)
+        for entry, ranges in ArchiveIndex(args.folder).query(*bbox,
+                start=args.start, end=args.end, points=args.points):
+            line = '{0}  {1:d}  {2}  {3}  {4:d} points'.format(entry['file'],
+                    entry['track'], format_timestamp(entry['start']),
+                    format_timestamp(entry['end']), entry['points'])
+            if args.points:
+                line += '  ' + ' '.join('{0:d}-{1:d}'.format(*point_range)
+                        for point_range in ranges)
+            print(line)
+        return 0
+
+    if args.command == 'watch':
+        watcher = DeviceWatcher(args.folder, args.interval,
+                cache_folder=args.cache, export_format=args.format,
+                metrics=metrics, simplify=simplify_options(args),
+                clear=args.clear)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if args.command == 'download' and args.all_devices:
+        ports = detect_devices()
+        if not ports:
+            print('No DG200 detected', file=sys.stderr)
+            return 1
+        def print_progress(received, total):
+            if total:
+                sys.stderr.write('\r{0:3d}%'.format(100 * received // total))
+                sys.stderr.flush()
+        results = download_devices(ports, args.folder, args.cache, args.new,
+                DownloadProgress(print_progress), export_format=args.format,
+                metrics=metrics, simplify=simplify_options(args),
+                resume=args.resume)
+        sys.stderr.write('\n')
+        for port in ports:
+            for filename in results[port]:
+                print(filename)
+        return 0
+
+    port = args.port
+    if port is None:
+        ports = detect_devices()
+        if not ports:
+            print('No DG200 detected', file=sys.stderr)
+            return 1
+        port = ports[0]
+    dg200 = DG200(metrics=metrics)
+    if not dg200.connect(port):
+        return 1
+    try:
+        if args.command == 'get-config':
+            conf = dg200.read_configuration()
+            if not conf:
+                return 1
+            for key, value in sorted(conf.as_dict().items()):
+                print(key + '=' + str(value))
+        elif args.command == 'set-config':
+            conf = dg200.read_configuration()
+            if not conf:
+                return 1
+            # a copy, the known configuration is the one of the device
+            conf = Configuration(**conf.as_dict())
+            for key, value in args.settings.items():
+                setattr(conf, key, value)
+            # nothing is sent if the settings don't change anything
+            if not dg200.set_configuration(conf):
+                print("Can't set device configuration", file=sys.stderr)
+                return 1
+        elif args.command == 'clear':
+            if not dg200.clear_memory():
+                print("Can't clear memory", file=sys.stderr)
+                return 1
+            print("Memory cleared")
+        else:
+            cache = TrackCache(args.cache, dg200.get_name())
+            if args.command == 'dump':
+                print(str(dump_memory(dg200, args.file, cache)) +
+                        ' track parts dumped to ' + args.file)
+                return 0
+            headers = dg200.get_headers()
+            table = HeaderTable(headers)
+            if args.command == 'list':
+                for session in range(len(table)):
+                    index, date, htime, first = table.first(session)
+                    print('{0:3d}  {1}  {2}  {3:3d} parts{4}'.format(
+                            session + 1, format_header_date(date),
+                            format_header_time(htime), table.size(session),
+                            '  new' if table.is_new(session, cache) else ''))
+            else:
+                keys = table.keys()
+                name = dg200.get_name()
+                checkpoint = DownloadCheckpoint(args.folder)
+                export_format = args.format
+                merge = args.merge
+                simplify = simplify_options(args)
+                if args.resume:
+                    sessions = checkpoint.resume(name, headers)
+                    if sessions is None:
+                        print('No download of ' + name + ' to resume in ' +
+                                args.folder, file=sys.stderr)
+                        return 1
+                    export_format = checkpoint.state['export_format']
+                    merge = checkpoint.state['merge']
+                    simplify = checkpoint.state['simplify']
+                else:
+                    sessions = [table.indices(session)
+                            for session in range(len(table))
+                            if (not args.tracks or session + 1 in args.tracks)
+                            and (not args.new or table.is_new(session, cache))]
+                    checkpoint.start(name, headers, sessions, export_format,
+                            merge, simplify)
+                try:
+                    if args.jobs == 1 and not merge:
+                        filenames = [download_track(dg200, list_index,
+                                args.folder, keys, cache,
+                                export_format=export_format,
+                                simplify=simplify, checkpoint=checkpoint)
+                                for list_index in sessions]
+                    else:
+                        filenames = download_sessions(dg200, sessions,
+                                args.folder, keys, cache,
+                                export_format=export_format,
+                                workers=args.jobs or None, merge=merge,
+                                simplify=simplify, checkpoint=checkpoint)
+                except IOError as error:
+                    print('Download interrupted: ' + str(error) +
+                            ', finish it with --resume', file=sys.stderr)
+                    return 1
+                # all the files are written
+                checkpoint.finish()
+                for filename in filenames:
+                    print(filename)
+                # get configuration for the diode to switch on
+                dg200.get_configuration()
+    finally:
+        dg200.close()
+    return 0
+
+
 # Execution du programme
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(cli())
     main()
     Gtk.main()
@@ -0,0 +1,357 @@
+#! /usr/bin/env python3
+
+#######################################
+############## PyDG200 ################
+#######################################
+# Benchmarks of the decoding, framing and export hot paths, and of a full
+# download from the simulated DG200.
+#
+# Licence: GPL3 http://gplv3.fsf.org/
+#
+
+import argparse
+import io
+import json
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import Py3DG200
+import Py3DG200sim
+
+def timed(function, min_time=0.5, repeat=3):
+    '''Runs function enough times to last min_time, repeat times, returns
+    the best time of one call'''
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat:
+            break
+        number *= 2
+    best = elapsed / number
+    for i in range(repeat - 1):
+        start = time.perf_counter()
+        for i in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def peak_memory(function):
+    '''Peak memory allocated by one call of function, in bytes'''
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def memory_image(point_format, nb_sessions=4, parts_per_session=25):
+    return Py3DG200sim.synthetic_memory(nb_sessions, parts_per_session,
+            point_format)
+
+def bench_bytes2int():
+    '''bytes2int on 4 bytes fields, bytes and old hex string lists'''
+    raw = b'\x01\x02\x03\x04' * 250
+    hexlist = Py3DG200.bytes2hexlist(raw)
+    def run():
+        for position in range(0, 1000, 4):
+            Py3DG200.bytes2int(raw[position:position + 4])
+            Py3DG200.bytes2int(hexlist[position:position + 4])
+    return run, 500, 2000
+
+def bench_process_point(point_format):
+    '''process_point on each record of a track part'''
+    payload = memory_image(point_format, 1, 1)[0][1]
+    size = 20 if point_format == 1 else 32
+    records = [payload[32 + size * num:32 + size * (num + 1)]
+            for num in range((len(payload) - 48) // size)]
+    records = [record for record in records if record != b'\xFF' * size]
+    def run():
+        for record in records:
+            Py3DG200.process_point(record)
+    return run, len(records), size * len(records)
+
+def bench_process_track_part(point_format, use_numpy):
+    '''Padding trimming and decoding of full track parts'''
+    parts = [memoryview(payload) for header, payload in
+            memory_image(point_format, 1, 10)]
+    nb_points = sum(len(Py3DG200.process_track_part(part)) for part in parts)
+    def run():
+        numpy = Py3DG200.numpy
+        if not use_numpy:
+            Py3DG200.numpy = None
+        try:
+            for part in parts:
+                Py3DG200.process_track_part(part)
+        finally:
+            Py3DG200.numpy = numpy
+    return run, nb_points, sum(len(part) for part in parts)
+
+def bench_decode_track(point_format):
+    '''Decoding of full track parts into a columnar Track'''
+    parts = [memoryview(payload) for header, payload in
+            memory_image(point_format, 1, 10)]
+    nb_points = sum(len(Py3DG200.decode_track(part)) for part in parts)
+    def run():
+        for part in parts:
+            Py3DG200.decode_track(part)
+    return run, nb_points, sum(len(part) for part in parts)
+
+def bench_simplify(use_numpy):
+    '''Simplification of a 10000 points Track, Douglas-Peucker with 10m
+    tolerance after resampling to one point every 2s'''
+    track = Py3DG200.Track()
+    for header, payload in memory_image(2, 1, 160):
+        track.extend(Py3DG200.decode_track(memoryview(payload)))
+    track = track.slice(0, 10000)
+    def run():
+        numpy = Py3DG200.numpy
+        if not use_numpy:
+            Py3DG200.numpy = None
+        try:
+            Py3DG200.simplify_track(track, tolerance=10, min_interval=2)
+        finally:
+            Py3DG200.numpy = numpy
+    return run, len(track), None
+
+def bench_index(use_numpy):
+    '''Archive index summary (bounding box, time range and grid) of a
+    10000 points Track'''
+    track = Py3DG200.Track()
+    for header, payload in memory_image(2, 1, 160):
+        track.extend(Py3DG200.decode_track(memoryview(payload)))
+    track = track.slice(0, 10000)
+    def run():
+        numpy = Py3DG200.numpy
+        if not use_numpy:
+            Py3DG200.numpy = None
+        try:
+            Py3DG200.TrackSummary().add(track)
+        finally:
+            Py3DG200.numpy = numpy
+    return run, len(track), None
+
+class OfflineDG200(Py3DG200.DG200):
+    '''DG200 reading data and writing to a buffer, without serial port'''
+    def __init__(self, data=b''):
+        Py3DG200.DG200.__init__(self)
+        self.input = io.BytesIO(data)
+        self.input_size = len(data)
+        self.write = io.BytesIO().write
+
+    def read(self, size=1):
+        return self.input.read(size)
+
+    def readinto(self, buffer):
+        return self.input.readinto(buffer)
+
+    @property
+    def in_waiting(self):
+        return self.input_size - self.input.tell()
+
+def bench_send():
+    '''Framing and checksum of 0xB5 commands'''
+    dg200 = OfflineDG200()
+    commands = [b'\xB5' + index.to_bytes(2, 'big') for index in range(1000)]
+    def run():
+        for command in commands:
+            dg200.send(command)
+    return run, len(commands), 8 * len(commands)
+
+def bench_receive():
+    '''Parsing and checksum of track part halves'''
+    frames = b''.join(Py3DG200sim.frame(b'\xB5' + payload[:1024]) +
+            Py3DG200sim.frame(b'\xB5' + payload[1024:])
+            for header, payload in memory_image(2, 1, 50))
+    def run():
+        dg200 = OfflineDG200(frames)
+        dg200.last_command = Py3DG200.encode_frame(b'\xB5\x00\x00')
+        for i in range(100):
+            dg200.receive()
+    return run, 100, len(frames)
+
+def bench_write_gpx(point_format, columnar=False):
+    '''GPX export of a 10000 points track, as a list of points or as a
+    Track'''
+    track = []
+    for header, payload in memory_image(point_format, 1, 100):
+        track.extend(Py3DG200.process_track_part(memoryview(payload)))
+    track = track[:10000]
+    if columnar:
+        track = Py3DG200.Track.from_points(track)
+    folder = tempfile.mkdtemp()
+    def run():
+        Py3DG200.write_gpx(folder, track if columnar else iter(track))
+    return run, len(track), None, lambda: shutil.rmtree(folder)
+
+def bench_export(export_format):
+    '''Export of a 10000 points Track in one of the EXPORTERS formats, and
+    loading it back for the binary ones'''
+    track = Py3DG200.Track()
+    for header, payload in memory_image(2, 1, 100):
+        track.extend(Py3DG200.decode_track(memoryview(payload)))
+    track = track.slice(0, 10000)
+    folder = tempfile.mkdtemp()
+    def run():
+        filename = Py3DG200.export_track(folder, track, export_format)
+        if export_format in ('track', 'npz'):
+            Py3DG200.load_track(filename)
+    return run, len(track), None, lambda: shutil.rmtree(folder)
+
+def bench_replay(workers):
+    '''GPX export of all the sessions of a memory dump, by a pool of
+    workers processes'''
+    folder = tempfile.mkdtemp()
+    filename = folder + '/memory.dump'
+    parts = memory_image(2, 16, 25)
+    with Py3DG200.DumpWriter(filename) as writer:
+        for header, payload in parts:
+            writer.write(Py3DG200.parse_headers(header)[0], payload)
+    dump = Py3DG200.MemoryDump(filename)
+    nb_points = sum(len(Py3DG200.decode_track(dump.part(header[0])))
+            for header in dump.headers.headers)
+    def run():
+        dump.export(folder, workers=workers)
+    def cleanup():
+        dump.close()
+        shutil.rmtree(folder)
+    return run, nb_points, len(parts) * Py3DG200sim.PART_SIZE, cleanup
+
+def bench_download(point_format, throughput):
+    '''Download of a whole synthetic memory image from the simulator'''
+    parts = memory_image(point_format)
+    simulator = Py3DG200sim.DG200Simulator(parts, throughput=throughput)
+    dg200 = Py3DG200.DG200()
+    dg200.connect(simulator.port)
+    folder = tempfile.mkdtemp()
+    nb_points = sum(len(Py3DG200.process_track_part(memoryview(payload)))
+            for header, payload in parts)
+    def run():
+        headers = dg200.get_headers()
+        for session in Py3DG200.group_sessions(headers):
+            Py3DG200.download_track(dg200, [header[0] for header in session],
+                    folder)
+    def cleanup():
+        dg200.close()
+        simulator.close()
+        shutil.rmtree(folder)
+    return run, nb_points, len(parts) * Py3DG200sim.PART_SIZE, cleanup
+
+BENCHMARKS = {
+    'bytes2int': bench_bytes2int,
+    'process_point_20': lambda: bench_process_point(1),
+    'process_point_32': lambda: bench_process_point(2),
+    'track_part_20': lambda: bench_process_track_part(1, False),
+    'track_part_32': lambda: bench_process_track_part(2, False),
+    'track_part_20_numpy': lambda: bench_process_track_part(1, True),
+    'track_part_32_numpy': lambda: bench_process_track_part(2, True),
+    'decode_track_20': lambda: bench_decode_track(1),
+    'decode_track_32': lambda: bench_decode_track(2),
+    'simplify': lambda: bench_simplify(False),
+    'simplify_numpy': lambda: bench_simplify(True),
+    'index': lambda: bench_index(False),
+    'index_numpy': lambda: bench_index(True),
+    'send': bench_send,
+    'receive': bench_receive,
+    'write_gpx_20': lambda: bench_write_gpx(1),
+    'write_gpx_32': lambda: bench_write_gpx(2),
+    'write_gpx_track_32': lambda: bench_write_gpx(2, True),
+    'export_csv': lambda: bench_export('csv'),
+    'export_geojson': lambda: bench_export('geojson'),
+    'export_track': lambda: bench_export('track'),
+    'export_npz_numpy': lambda: bench_export('npz'),
+    'replay_1': lambda: bench_replay(1),
+    'replay_4': lambda: bench_replay(4),
+    'download_20': lambda: bench_download(1, 0),
+    'download_32': lambda: bench_download(2, 0),
+    'download_32_230400': lambda: bench_download(2, 23040),
+    }
+
+def run_benchmarks(names, min_time=0.5):
+    '''Runs the benchmarks, returns {name: {'time', 'items_per_s',
+    'bytes_per_s', 'peak_memory'}}'''
+    results = {}
+    for name in names:
+        if name.endswith('_numpy') and Py3DG200.numpy is None:
+            continue
+        setup = BENCHMARKS[name]()
+        run, items, nbytes = setup[:3]
+        try:
+            if name.startswith('download'):
+                # a download takes long enough, don't repeat it
+                start = time.perf_counter()
+                run()
+                duration = time.perf_counter() - start
+            else:
+                duration = timed(run, min_time)
+            memory = peak_memory(run)
+        finally:
+            if len(setup) > 3:
+                setup[3]()
+        results[name] = {
+            'time': duration,
+            'items_per_s': items / duration,
+            'bytes_per_s': nbytes / duration if nbytes else None,
+            'peak_memory': memory,
+            }
+    return results
+
+def print_results(results, baseline=None, tolerance=0.2):
+    '''Prints the results, compared to baseline when given. Returns the
+    names of the benchmarks slower than the baseline by more than
+    tolerance'''
+    regressions = []
+    print('{0:22s} {1:>12s} {2:>14s} {3:>12s} {4:>10s}'.format('benchmark',
+            'time (ms)', 'items/s', 'MB/s', 'peak (kB)'))
+    for name, result in results.items():
+        line = '{0:22s} {1:12.3f} {2:14.0f} {3:>12s} {4:10.0f}'.format(name,
+                1000 * result['time'], result['items_per_s'],
+                '-' if result['bytes_per_s'] is None else
+                '{0:.2f}'.format(result['bytes_per_s'] / 1e6),
+                result['peak_memory'] / 1000)
+        if baseline and name in baseline:
+            ratio = result['time'] / baseline[name]['time']
+            line += '  {0:+.0%}'.format(ratio - 1)
+            if ratio > 1 + tolerance:
+                line += ' REGRESSION'
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+# Execution du programme
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='Py3DG200bench',
+            description='Benchmarks of PyDG200')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+            help='benchmarks to run (default: all): ' +
+            ', '.join(BENCHMARKS))
+    parser.add_argument('--min-time', type=float, default=0.5,
+            help='minimal duration of each timing (s)')
+    parser.add_argument('--save', metavar='FILE',
+            help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+            help='compare to a saved baseline, fail on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+            help='slowdown reported as a regression (default: 0.2)')
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark ' + name)
+    results = run_benchmarks(args.benchmarks or list(BENCHMARKS),
+            args.min_time)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+    regressions = print_results(results, baseline, args.tolerance)
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+    if regressions:
+        sys.exit(1)
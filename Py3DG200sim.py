@@ -0,0 +1,289 @@
+#! /usr/bin/env python3
+
+#######################################
+############## PyDG200 ################
+#######################################
+# DG200 simulator: serves a synthetic memory image on a pseudo-terminal,
+# speaking the same protocol as the data logger. Used for testing and
+# benchmarking without a device.
+#
+# Licence: GPL3 http://gplv3.fsf.org/
+#
+
+import argparse
+import os
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+PART_SIZE = 2048 # payload of a track part (both halves of the 0xB5 answer)
+HEADERS_PER_PAGE = 40 # headers sent by each 0xBB answer
+CAPACITY = 1000 # number of track parts the memory can hold
+
+def encode_degrees(value):
+    '''Converts degrees to the DDDMMmmmm integer coding of the device'''
+    negative = value < 0
+    value = abs(value)
+    coded = int(value) * 1000000 + int(round((value - int(value)) * 600000))
+    if negative:
+        return 2**32 - coded
+    return coded
+
+def encode_point(latitude, longitude, timestamp, speed, altitude=None,
+        point_format=0):
+    '''Encodes a point as a 20 bytes record, or a 32 bytes one when altitude
+    is given. timestamp is a time.struct_time, speed is in m/s and
+    altitude in m. point_format is stored in the unused bytes 28-32, as
+    the device does for the first point of a part'''
+    utime = timestamp.tm_hour * 10000 + timestamp.tm_min * 100 \
+            + timestamp.tm_sec
+    udate = timestamp.tm_mday * 10000 + timestamp.tm_mon * 100 \
+            + timestamp.tm_year % 100
+    record = struct.pack('>IIIII', encode_degrees(latitude),
+            encode_degrees(longitude), utime, udate,
+            int(round(speed * 3.6 * 100)))
+    if altitude is None:
+        return record
+    altitude = int(round(altitude * 10000))
+    if altitude < 0:
+        altitude += 2**32
+    return record + struct.pack('>I4xI', altitude, point_format)
+
+def synthetic_memory(nb_sessions=3, parts_per_session=4, point_format=2,
+        interval=5, start=1262304000, seed=0):
+    '''Builds a synthetic memory image: a list of (header, payload) track
+    parts, the header being a 12 bytes header as returned by 0xBB and the
+    payload the PART_SIZE bytes returned by 0xB5. point_format is 1 for 20
+    bytes records (position, date/time, speed) or 2 for 32 bytes records
+    (with altitude). The last part of each session is half full and every
+    50th point is a waypoint'''
+    generator = random.Random(seed)
+    parts = []
+    timestamp = start
+    nb_total = 0
+    for session in range(nb_sessions):
+        latitude = generator.uniform(-60, 60)
+        longitude = generator.uniform(-170, 170)
+        altitude = generator.uniform(-50, 2000)
+        for part in range(parts_per_session):
+            if point_format == 1:
+                nb_points = (PART_SIZE - 32 - 16) // 20 + 1
+            else:
+                nb_points = PART_SIZE // 32
+            if part == parts_per_session - 1:
+                nb_points //= 2
+            records = []
+            header_time = time.gmtime(timestamp)
+            for num in range(nb_points):
+                latitude += generator.uniform(-0.0005, 0.0005)
+                longitude += generator.uniform(-0.0005, 0.0005)
+                altitude += generator.uniform(-2, 2)
+                point_latitude = latitude
+                nb_total += 1
+                if nb_total % 50 == 0:
+                    point_latitude += 100 # waypoint
+                if num == 0 or point_format == 2:
+                    # the first point is always in the 32 bytes format
+                    records.append(encode_point(point_latitude, longitude,
+                            time.gmtime(timestamp), generator.uniform(0, 30),
+                            altitude, point_format if num == 0 else 0))
+                else:
+                    records.append(encode_point(point_latitude, longitude,
+                            time.gmtime(timestamp), generator.uniform(0, 30)))
+                timestamp += interval
+            payload = b''.join(records)
+            payload += b'\xFF' * (PART_SIZE - len(payload))
+            # first in session flag and time, date, index
+            header = struct.pack('>III', (0x80 if part == 0 else 0) << 24
+                    | header_time.tm_hour * 10000 + header_time.tm_min * 100
+                    + header_time.tm_sec,
+                    header_time.tm_mday * 10000 + header_time.tm_mon * 100
+                    + header_time.tm_year % 100,
+                    len(parts))
+            parts.append((header, payload))
+        timestamp += 3600
+    return parts
+
+def frame(payload):
+    '''Frames a device answer'''
+    return struct.pack('>2sH', b'\xA0\xA2', len(payload)) + payload + \
+            struct.pack('>H2s', sum(payload) % (2**15), b'\xB0\xB3')
+
+
+class DG200Simulator:
+    '''Simulated DG200 on a pseudo-terminal, whose name is in self.port.
+    latency is the delay (s) before each answer, throughput the speed of
+    the link in bytes/s (0 for no limit), busy_rate the probability of a
+    0x12 "busy" answer before the real one, error_rate the probability of
+    an answer with a corrupted byte and drop_rate the probability that an
+    answer isn't sent at all. noise_rate is the probability of garbage
+    bytes before an answer'''
+    def __init__(self, parts=None, device_id=b'DG200SIM', latency=0.,
+            throughput=23040, busy_rate=0., error_rate=0., drop_rate=0.,
+            noise_rate=0., seed=0):
+        if parts is None:
+            parts = synthetic_memory()
+        self.parts = list(parts)
+        self.device_id = device_id
+        self.latency = latency
+        self.throughput = throughput
+        self.busy_rate = busy_rate
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.noise_rate = noise_rate
+        self.random = random.Random(seed)
+        point_format = 2
+        if self.parts:
+            point_format = struct.unpack_from('>I', self.parts[0][1], 28)[0]
+        # configuration as returned by 0xB7, without the command byte
+        self.configuration = bytearray(42)
+        self.configuration[0] = point_format
+        self.configuration[11:15] = struct.pack('>I', 5000)
+        self.configuration[40] = 4
+        self.commands = {
+            0xB5: self.get_track_part,
+            0xB7: self.get_configuration,
+            0xB8: self.set_configuration,
+            0xBA: self.clear_memory,
+            0xBB: self.get_headers,
+            0xBF: self.get_id,
+            }
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def run(self):
+        buffer = bytearray()
+        while not self.stop_event.is_set():
+            ready = select.select([self.master], [], [], 0.05)[0]
+            if not ready:
+                continue
+            try:
+                buffer.extend(os.read(self.master, 4096))
+            except OSError:
+                continue
+            while True:
+                start = buffer.find(b'\xA0\xA2')
+                if start < 0:
+                    del buffer[:-1]
+                    break
+                del buffer[:start]
+                if len(buffer) < 4:
+                    break
+                length = struct.unpack_from('>H', buffer, 2)[0]
+                if len(buffer) < length + 8:
+                    break
+                payload = bytes(buffer[4:4 + length])
+                checksum, end = struct.unpack_from('>H2s', buffer, length + 4)
+                del buffer[:length + 8]
+                # commands are summed modulo 2**15-1, unlike the answers
+                if end == b'\xB0\xB3' and payload and \
+                        checksum == sum(payload) % (2**15-1):
+                    self.answer(payload)
+
+    def write(self, data):
+        if not self.throughput:
+            os.write(self.master, data)
+            return
+        for position in range(0, len(data), 256):
+            chunk = data[position:position + 256]
+            os.write(self.master, chunk)
+            time.sleep(len(chunk) / self.throughput)
+
+    def answer(self, command):
+        handler = self.commands.get(command[0])
+        if handler is None:
+            return
+        for payload in handler(command):
+            if self.latency:
+                time.sleep(self.latency)
+            if self.random.random() < self.drop_rate:
+                continue
+            if self.random.random() < self.busy_rate:
+                self.write(frame(b'\x12'))
+            if self.random.random() < self.noise_rate:
+                self.write(bytes(self.random.getrandbits(8)
+                        for i in range(self.random.randrange(1, 20))))
+            answer = frame(payload)
+            if self.random.random() < self.error_rate:
+                corrupted = bytearray(answer)
+                position = self.random.randrange(2, len(answer))
+                corrupted[position] ^= 0xFF
+                answer = bytes(corrupted)
+            self.write(answer)
+
+    def get_id(self, command):
+        return [b'\xBF' + self.device_id]
+
+    def get_configuration(self, command):
+        memory_usage = min(100, 100 * len(self.parts) // CAPACITY)
+        return [b'\xB7' + bytes(self.configuration) + bytes([memory_usage])]
+
+    def set_configuration(self, command):
+        self.configuration[:len(command) - 1] = command[1:]
+        return [b'\xB8']
+
+    def clear_memory(self, command):
+        self.parts = []
+        return [b'\xBA\x00\x00\x00\x00']
+
+    def get_headers(self, command):
+        start = struct.unpack_from('>H', command, 1)[0]
+        headers = [header for header, payload in
+                self.parts[start:start + HEADERS_PER_PAGE]]
+        next_index = start + HEADERS_PER_PAGE
+        if next_index >= len(self.parts):
+            next_index = 0
+        return [struct.pack('>BHH', 0xBB, len(headers), next_index)
+                + b''.join(headers)]
+
+    def get_track_part(self, command):
+        index = struct.unpack_from('>H', command, 1)[0]
+        for header, payload in self.parts:
+            if struct.unpack_from('>I', header, 8)[0] == index:
+                return [b'\xB5' + payload[:PART_SIZE // 2],
+                        b'\xB5' + payload[PART_SIZE // 2:]]
+        return []
+
+
+# Execution du programme
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='Py3DG200sim',
+            description='Simulated DG200 on a pseudo-terminal')
+    parser.add_argument('--format', type=int, choices=(1, 2), default=2,
+            help='1: 20 bytes records, 2: 32 bytes records with altitude')
+    parser.add_argument('--sessions', type=int, default=3)
+    parser.add_argument('--parts', type=int, default=4,
+            help='track parts per session')
+    parser.add_argument('--latency', type=float, default=0.,
+            help='delay before each answer (s)')
+    parser.add_argument('--throughput', type=int, default=23040,
+            help='link speed (bytes/s, 0 for no limit)')
+    parser.add_argument('--busy-rate', type=float, default=0.)
+    parser.add_argument('--error-rate', type=float, default=0.)
+    parser.add_argument('--drop-rate', type=float, default=0.)
+    parser.add_argument('--noise-rate', type=float, default=0.)
+    args = parser.parse_args()
+    simulator = DG200Simulator(
+            synthetic_memory(args.sessions, args.parts, args.format),
+            latency=args.latency, throughput=args.throughput,
+            busy_rate=args.busy_rate, error_rate=args.error_rate,
+            drop_rate=args.drop_rate, noise_rate=args.noise_rate)
+    print('Simulated DG200 on ' + simulator.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.close()
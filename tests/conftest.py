@@ -0,0 +1,63 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Py3DG200
+import Py3DG200sim
+
+
+@pytest.fixture
+def simulator():
+    '''Factory of DG200Simulator without throughput limit, closed after the
+    test'''
+    simulators = []
+
+    def make(parts=None, **options):
+        options.setdefault('throughput', 0)
+        simulators.append(Py3DG200sim.DG200Simulator(parts, **options))
+        return simulators[-1]
+
+    yield make
+    for sim in simulators:
+        sim.close()
+
+
+@pytest.fixture
+def device():
+    '''Factory of DG200 connected to a port, closed after the test'''
+    devices = []
+
+    def connect(port, timeout=0.2):
+        devices.append(Py3DG200.DG200(timeout))
+        assert devices[-1].connect(port)
+        return devices[-1]
+
+    yield connect
+    for dg200 in devices:
+        dg200.close()
+
+
+@pytest.fixture
+def without_numpy(monkeypatch):
+    '''Calls a function with the pure Python decoding, to compare it with
+    the numpy one'''
+    pytest.importorskip('numpy')
+
+    def call(function, *args, **kwargs):
+        with monkeypatch.context() as context:
+            context.setattr(Py3DG200, 'numpy', None)
+            return function(*args, **kwargs)
+
+    return call
+
+
+@pytest.fixture(params=[1, 2])
+def track(request):
+    '''Track of two sessions of 20 or 32 bytes records'''
+    track = Py3DG200.Track()
+    for header, payload in Py3DG200sim.synthetic_memory(2, 3, request.param):
+        track.extend(Py3DG200.decode_track(memoryview(payload)))
+    return track
@@ -0,0 +1,12 @@
+import pytest
+
+import Py3DG200
+
+
+def test_parse_setting():
+    assert Py3DG200.parse_setting('waas=on') == ('waas', True)
+    assert Py3DG200.parse_setting('time_interval=2.5') == \
+            ('time_interval', 2.5)
+    for setting in ('waas', 'waas=maybe', 'unknown=1', 'speed_threshold=-3'):
+        with pytest.raises(ValueError):
+            Py3DG200.parse_setting(setting)
@@ -0,0 +1,58 @@
+import pytest
+
+import Py3DG200
+import Py3DG200sim
+
+
+def test_round_trip(simulator, device):
+    sim = simulator(Py3DG200sim.synthetic_memory(1, 2))
+    dg200 = device(sim.port)
+    settings = {'format': 2, 'disable_speed': True, 'speed_threshold': 12,
+            'disable_distance': False, 'distance_threshold': 250,
+            'time_interval': 2.5, 'by_distance': True,
+            'distance_interval': 40, 'waas': True}
+    assert dg200.set_configuration(settings)
+    dg200.forget_state()
+    configuration = dg200.read_configuration()
+    assert configuration.as_dict() == dict(settings, memory_usage=0)
+
+
+def test_memory_usage(simulator, device):
+    parts = Py3DG200sim.synthetic_memory(1, 2)
+    sim = simulator(parts * 150)
+    dg200 = device(sim.port)
+    assert dg200.read_configuration().memory_usage == \
+            100 * len(sim.parts) // Py3DG200sim.CAPACITY
+
+
+def test_unchanged_configuration_isnt_sent(simulator, device):
+    sim = simulator(Py3DG200sim.synthetic_memory(1, 2))
+    sent = []
+    set_configuration = sim.commands[0xB8]
+    sim.commands[0xB8] = lambda command: sent.append(command) or \
+            set_configuration(command)
+    dg200 = device(sim.port)
+    configuration = dg200.read_configuration()
+    assert dg200.set_configuration(configuration.as_dict())
+    assert sent == []
+    assert dg200.set_configuration(dict(configuration.as_dict(),
+            waas=not configuration.waas))
+    assert len(sent) == 1
+
+
+def test_encode_decode():
+    configuration = Py3DG200.Configuration(format=1, speed_threshold=5,
+            time_interval=0.5, distance_interval=100, waas=True)
+    answer = b'\xB7' + configuration.encode()[1:] + b'\x07'
+    decoded = Py3DG200.Configuration.decode(answer)
+    assert decoded == configuration
+    assert decoded.memory_usage == 7
+
+
+@pytest.mark.parametrize('settings', [{'speed_threshold': -1},
+        {'format': 256}, {'time_interval': 5e6},
+        {'distance_interval': 2**32}])
+def test_out_of_range(settings):
+    with pytest.raises(ValueError):
+        Py3DG200.Configuration(**settings)
+
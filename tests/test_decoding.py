@@ -0,0 +1,23 @@
+import pytest
+
+import Py3DG200
+import Py3DG200sim
+
+
+@pytest.mark.parametrize('point_format', [1, 2])
+def test_decode(without_numpy, point_format):
+    for header, payload in Py3DG200sim.synthetic_memory(2, 3, point_format):
+        track = Py3DG200.decode_track(memoryview(payload))
+        assert track.to_bytes() == without_numpy(Py3DG200.decode_track,
+                memoryview(payload)).to_bytes()
+        assert Py3DG200.process_track_part(memoryview(payload)) == \
+                without_numpy(Py3DG200.process_track_part,
+                    memoryview(payload))
+
+
+def test_timestamps_of_invalid_dates():
+    numpy = pytest.importorskip('numpy')
+    columns = {'date': numpy.array([10110, 0, 310210]),
+            'time': numpy.array([120000, 0, 256161])}
+    assert Py3DG200.columns_timestamps(columns) == ['2010-01-01T12:00:00Z',
+            '2000-00-00T00:00:00Z', '2010-02-31T25:61:61Z']
@@ -0,0 +1,37 @@
+import os
+import time
+import tty
+
+import Py3DG200
+
+
+def test_cached_ports(monkeypatch, tmp_path):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    ports = {'/dev/ttyUSB0': 'USB VID:PID=10C4:EA60 SER=0001',
+            '/dev/ttyUSB1': 'USB VID:PID=067B:2303'}
+    monkeypatch.setattr(Py3DG200, 'list_serial_ports', lambda: ports)
+    probed = []
+
+    def probe_device(port, timeout):
+        probed.append(port)
+        return b'\x01\x02'
+
+    monkeypatch.setattr(Py3DG200, 'probe_device', probe_device)
+    assert Py3DG200.detect_devices() == sorted(ports)
+    assert sorted(probed) == sorted(ports)
+    # only the adapter with a serial number is trusted without probing
+    del probed[:]
+    assert Py3DG200.detect_devices() == sorted(ports)
+    assert probed == ['/dev/ttyUSB1']
+
+
+def test_probe_silent_port():
+    master, slave = os.openpty()
+    try:
+        tty.setraw(slave)
+        start = time.monotonic()
+        assert Py3DG200.probe_device(os.ttyname(slave)) is None
+        assert time.monotonic() - start < 0.5
+    finally:
+        os.close(master)
+        os.close(slave)
@@ -0,0 +1,69 @@
+import filecmp
+import os
+
+import Py3DG200
+import Py3DG200sim
+
+
+def test_resume(simulator, tmp_path, monkeypatch):
+    monkeypatch.setattr(Py3DG200.DeviceClient, 'max_retries', 0)
+    parts = Py3DG200sim.synthetic_memory(2, 4)
+    sim = simulator(parts)
+    get_track_part = sim.commands[0xB5]
+    requests = []
+
+    def failing(command):
+        requests.append(command)
+        # the device stops answering after three parts
+        return [] if len(requests) > 3 else get_track_part(command)
+
+    sim.commands[0xB5] = failing
+    folder = str(tmp_path / 'resumed')
+    os.makedirs(folder)
+    assert Py3DG200.cli(['-p', sim.port, '--cache', str(tmp_path / 'cache'),
+            'download', '-o', folder]) == 1
+    assert len(os.listdir(os.path.join(folder,
+            Py3DG200.DownloadCheckpoint.name))) == 3
+
+    sim.commands[0xB5] = get_track_part
+    assert Py3DG200.cli(['-p', sim.port, '--cache', str(tmp_path / 'cache'),
+            'download', '-o', folder, '--resume']) == 0
+    assert not os.path.exists(os.path.join(folder,
+            Py3DG200.DownloadCheckpoint.name))
+
+    reference = str(tmp_path / 'reference')
+    os.makedirs(reference)
+    assert Py3DG200.cli(['-p', sim.port, '--cache',
+            str(tmp_path / 'other-cache'), 'download', '-o', reference]) == 0
+    files = sorted(name for name in os.listdir(reference)
+            if name.endswith('.gpx'))
+    assert len(files) == 2
+    assert sorted(name for name in os.listdir(folder)
+            if name.endswith('.gpx')) == files
+    assert filecmp.cmpfiles(folder, reference, files, shallow=False)[0] == \
+            files
+
+
+def test_is_archived(simulator, device, tmp_path):
+    parts = Py3DG200sim.synthetic_memory(2, 3)
+    sim = simulator(parts)
+    dg200 = device(sim.port)
+    headers = dg200.get_headers()
+    indices = {header[0] for header in headers}
+    cache = Py3DG200.TrackCache(str(tmp_path))
+    assert Py3DG200.is_archived(dg200, headers, cache, indices)
+    # the last part is never cached: it must have been exported
+    assert not Py3DG200.is_archived(dg200, headers, cache,
+            indices - {headers[-1][0]})
+    assert not Py3DG200.is_archived(dg200, headers, cache, indices - {1})
+
+    keys = Py3DG200.TrackCache.header_keys(headers)
+    for index, key in keys.items():
+        payload = parts[index][1]
+        cache.put(key, payload, Py3DG200.decode_track(memoryview(payload)))
+    assert Py3DG200.is_archived(dg200, headers, cache, {headers[-1][0]})
+
+    # parts recorded since the download
+    sim.parts.extend(Py3DG200sim.synthetic_memory(1, 1, seed=1))
+    assert not Py3DG200.is_archived(dg200, headers, cache, indices)
+    assert not Py3DG200.is_archived(dg200, [], cache, indices)
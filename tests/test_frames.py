@@ -0,0 +1,41 @@
+import random
+
+import Py3DG200
+import Py3DG200sim
+
+
+def noise(generator, size):
+    # without A0, which could start a frame
+    return bytes(generator.choice([byte for byte in range(256)
+            if byte != 0xA0]) for i in range(size))
+
+
+def test_frame_buffer_resynchronises():
+    generator = random.Random(1)
+    payloads = [bytes(generator.getrandbits(8)
+            for i in range(generator.randrange(1, 3000))) for frame in range(50)]
+    stream = b''.join(noise(generator, generator.randrange(0, 30)) +
+            Py3DG200sim.frame(payload) for payload in payloads)
+    frames = Py3DG200.FrameBuffer()
+    received = []
+    position = 0
+    while position < len(stream):
+        size = generator.randrange(1, 5000)
+        frames.feed(stream[position:position + size])
+        position += size
+        payload = frames.next_frame()
+        while payload is not None:
+            received.append(bytes(payload))
+            payload = frames.next_frame()
+    assert received == payloads
+    assert frames.skipped > 0
+
+
+def test_frame_buffer_corrupted_frame():
+    frames = Py3DG200.FrameBuffer()
+    corrupted = bytearray(Py3DG200sim.frame(b'\xBF1234'))
+    corrupted[5] ^= 0xFF
+    frames.feed(bytes(corrupted) + Py3DG200sim.frame(b'\xBF5678'))
+    assert frames.next_frame() is False
+    assert bytes(frames.next_frame()) == b'\xBF5678'
+    assert frames.next_frame() is None
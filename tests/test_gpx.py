@@ -0,0 +1,35 @@
+import os
+
+import Py3DG200
+import Py3DG200sim
+
+
+def points():
+    points = []
+    for header, payload in Py3DG200sim.synthetic_memory(1, 3):
+        points.extend(Py3DG200.process_track_part(memoryview(payload)))
+    return points
+
+
+def test_waypoints_before_track(tmp_path):
+    writer = Py3DG200.GpxWriter(str(tmp_path))
+    track = points()
+    writer.write(track[:500])
+    # the track is streamed to the file as it comes
+    assert os.path.getsize(writer.filename + '.part') > 0
+    writer.write(track[500:])
+    with open(writer.close()) as gpx_file:
+        gpx = gpx_file.read()
+    waypoints = sum(1 for point in track if abs(point[0]) > 100)
+    assert waypoints > 0
+    assert gpx.count('<wpt ') == waypoints
+    assert gpx.count('<trkpt ') == len(track) - waypoints
+    assert gpx.rindex('</wpt>') < gpx.index('<trk>')
+    assert os.listdir(str(tmp_path)) == [os.path.basename(writer.filename)]
+
+
+def test_abort(tmp_path):
+    writer = Py3DG200.GpxWriter(str(tmp_path))
+    writer.write(points())
+    writer.abort()
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,31 @@
+import Py3DG200
+
+
+def test_index_summary(without_numpy, track):
+    def summary(block_size):
+        track_summary = Py3DG200.TrackSummary()
+        for start in range(0, len(track), block_size):
+            track_summary.add(track.slice(start, start + block_size))
+        return track_summary.as_dict()
+
+    assert summary(97) == summary(len(track))
+    assert summary(97) == without_numpy(summary, 97)
+
+
+def test_index_query(tmp_path, track):
+    filename = Py3DG200.export_track(str(tmp_path), track, 'track')
+    index = Py3DG200.ArchiveIndex(str(tmp_path))
+    assert len(index) == 1
+    for position in range(0, len(track), 50):
+        latitude, longitude = track.latitude[position], \
+                track.longitude[position]
+        box = (latitude - 0.001, longitude - 0.001, latitude + 0.001,
+                longitude + 0.001)
+        inside = [point for point in range(len(track))
+                if box[0] <= track.latitude[point] <= box[2] and
+                box[1] <= track.longitude[point] <= box[3]]
+        ((entry, ranges),) = index.query(*box, points=True)
+        assert entry['file'] == filename.rsplit('/', 1)[1]
+        assert all(any(start <= point < stop for start, stop in ranges)
+                for point in inside)
+    assert index.query(0.5, 0.5, 0.6, 0.6) == []
@@ -0,0 +1,32 @@
+import Py3DG200
+import Py3DG200sim
+
+
+def test_commands_in_list_form(simulator):
+    sim = simulator(Py3DG200sim.synthetic_memory(1, 2))
+    metrics = Py3DG200.Metrics()
+    dg200 = Py3DG200.DG200(0.2, metrics)
+    try:
+        assert dg200.connect(sim.port)
+        dg200.send(['0xB7'])
+        assert dg200.receive() is not None
+    finally:
+        dg200.close()
+    assert metrics.summary()['commands']['B7']['count'] == 1
+
+
+def test_stages_of_export_processes(simulator, tmp_path):
+    sim = simulator(Py3DG200sim.synthetic_memory(2, 3))
+    metrics = Py3DG200.Metrics()
+    dg200 = Py3DG200.DG200(0.2, metrics)
+    try:
+        assert dg200.connect(sim.port)
+        headers = Py3DG200.HeaderTable(dg200.get_headers())
+        sessions = [headers.indices(session)
+                for session in range(len(headers))]
+        assert len(Py3DG200.download_sessions(dg200, sessions, str(tmp_path),
+                workers=2)) == 2
+    finally:
+        dg200.close()
+    stages = metrics.summary()['stages']
+    assert stages['decode']['count'] == stages['export']['count'] == 6
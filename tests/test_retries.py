@@ -0,0 +1,79 @@
+import asyncio
+import os
+import threading
+import time
+import tty
+
+import pytest
+
+import Py3DG200
+import Py3DG200sim
+
+
+def test_download_from_unreliable_device(simulator, device):
+    parts = Py3DG200sim.synthetic_memory(2, 5)
+    sim = simulator(parts, busy_rate=0.2, error_rate=0.1, drop_rate=0.05,
+            noise_rate=0.2, seed=3)
+    dg200 = device(sim.port)
+    headers = dg200.get_headers()
+    assert len(headers) == len(parts)
+    for index, date, htime, first in headers:
+        assert dg200.get_track_part(index) == parts[index][1]
+
+
+def test_async_download_from_unreliable_device(simulator):
+    parts = Py3DG200sim.synthetic_memory(2, 5)
+    sim = simulator(parts, busy_rate=0.2, error_rate=0.1, drop_rate=0.05,
+            noise_rate=0.2, seed=4)
+
+    async def download():
+        async with Py3DG200.AsyncDG200(timeout=0.2) as dg200:
+            assert await dg200.connect(sim.port)
+            return [await dg200.get_track_part(index)
+                    for index, date, htime, first in await dg200.get_headers()]
+
+    assert asyncio.run(download()) == [payload for header, payload in parts]
+
+
+@pytest.fixture
+def garbage_port():
+    '''Port of a pseudo-terminal streaming 0x55 bytes'''
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    # not to block once nothing reads the stream
+    os.set_blocking(master, False)
+    stop = threading.Event()
+
+    def stream():
+        while not stop.is_set():
+            try:
+                os.write(master, b'\x55' * 256)
+            except OSError:
+                time.sleep(0.001)
+
+    thread = threading.Thread(target=stream, daemon=True)
+    thread.start()
+    yield os.ttyname(slave)
+    stop.set()
+    thread.join()
+    os.close(master)
+    os.close(slave)
+
+
+def test_garbage_stream_doesnt_hang(garbage_port, device):
+    dg200 = device(garbage_port)
+    start = time.monotonic()
+    assert dg200.get_id() is None
+    # max_retries + 1 frame reads and drains, bounded by the timeout
+    assert time.monotonic() - start < 4
+
+
+def test_async_garbage_stream_doesnt_hang(garbage_port):
+    async def get_id():
+        async with Py3DG200.AsyncDG200(timeout=0.2) as dg200:
+            assert await dg200.connect(garbage_port)
+            return await dg200.get_id()
+
+    start = time.monotonic()
+    assert asyncio.run(get_id()) is None
+    assert time.monotonic() - start < 4
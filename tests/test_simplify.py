@@ -0,0 +1,13 @@
+import pytest
+
+import Py3DG200
+
+
+@pytest.mark.parametrize('options', [{'tolerance': 5},
+        {'min_interval': 30}, {'min_distance': 50}, {'min_speed': 3},
+        {'tolerance': 20, 'min_interval': 10, 'min_speed': 1}])
+def test_simplify(without_numpy, track, options):
+    simplified = Py3DG200.simplify_track(track, **options)
+    assert 0 < len(simplified) < len(track)
+    assert simplified.to_bytes() == without_numpy(Py3DG200.simplify_track,
+            track, **options).to_bytes()